@@ -1,95 +1,60 @@
-import pandas as pd
-from sqlalchemy import create_engine
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import accuracy_score
-import numpy as np
-import matplotlib.pyplot as plt
-
-# Connect to the SQLite database
-engine = create_engine('sqlite:///instance/sensor_data.db')
-df = pd.read_sql('SELECT * FROM sensor_data', engine)
-
-# Convert timestamp to datetime and calculate time difference
-df['timestamp'] = pd.to_datetime(df['timestamp'])
-df['time_diff'] = df['timestamp'].diff().dt.total_seconds().fillna(0)
-
-# Extract rolling features (using the last 5 data points as an example)
-df['temperature_roll'] = df['temperature'].rolling(window=5, min_periods=1).mean()
-df['humidity_roll'] = df['humidity'].rolling(window=5, min_periods=1).mean()
-df['pressure_roll'] = df['pressure'].rolling(window=5, min_periods=1).mean()
-df['light_roll'] = df['light'].rolling(window=5, min_periods=1).mean()
-df['tvoc_roll'] = df['tvoc'].rolling(window=5, min_periods=1).mean()
-df['smoke_roll'] = df['smoke'].rolling(window=5, min_periods=1).mean()
-
-# Select relevant features, including rolling features
-features = df[['temperature_roll', 'humidity_roll', 'pressure_roll', 'light_roll', 'tvoc_roll', 'smoke_roll', 'time_diff']]
-
-# Dictionary to store models and their predictions
-models = {}
-alarms = ['temp_alarm', 'humidity_alarm', 'pressure_alarm', 'tvoc_alarm', 'smoke_alarm']
-predictions = {}
-
-for alarm in alarms:
-    # Define target variable
-    target = df[alarm]
-
-    # Split the data into training and testing sets
-    X_train, X_test, y_train, y_test = train_test_split(features, target, test_size=0.2, random_state=42)
-
-    # Train a Random Forest model for each alarm
-    model = RandomForestClassifier(n_estimators=100, random_state=42)
-    model.fit(X_train, y_train)
-
-    # Save the model and evaluate accuracy
-    models[alarm] = model
-    y_pred = model.predict(X_test)
-    print(f"{alarm} Model Accuracy: {accuracy_score(y_test, y_pred)}")
-
-# Updated prediction function for the next 5 minutes (150 intervals of 2 seconds each)
-def predict_future_alarms(data, models, prediction_intervals=150):
-    predictions = {alarm: [] for alarm in models.keys()}
-
-    for interval in range(prediction_intervals):
-        # Create a synthetic future data point based on rolling averages
-        future_data = pd.DataFrame(data.mean()).T
-        future_data['time_diff'] = data['time_diff'].mean()  # Average time difference
-
-        # Predict each alarm separately
-        for alarm, model in models.items():
-            alarm_prediction = model.predict(future_data)[0]
-            predictions[alarm].append(alarm_prediction)
-
-        # Update data with the new synthetic data point
-        data = pd.concat([data, future_data]).iloc[1:]
-
-    return predictions
-
-# Use all data in the database for predictions
-all_data = df[['temperature_roll', 'humidity_roll', 'pressure_roll', 'light_roll', 'tvoc_roll', 'smoke_roll', 'time_diff']]
-
-# Predict alarm likelihood for each alarm type for the next 5 minutes using all data
-predictions = predict_future_alarms(all_data, models)
-print("Predicted alarm occurrences for the next 5 minutes for each alarm type:", predictions)
-
-# Plot predictions for each alarm type in a single figure with subplots
-fig, axes = plt.subplots(nrows=3, ncols=2, figsize=(15, 10))
-fig.suptitle('Predicted Alarm Occurrences for the Next 5 Minutes')
-
-# Define alarm labels for each subplot
-alarm_labels = ['Temperature Alarm', 'Humidity Alarm', 'Pressure Alarm', 'TVOC Alarm', 'Smoke Alarm']
-
-for i, (alarm, alarm_predictions) in enumerate(predictions.items()):
-    row, col = divmod(i, 2)
-    alarm_seconds = [2 * interval for interval, pred in enumerate(alarm_predictions) if pred == 1]
-    axes[row, col].hist(alarm_seconds, bins=30, alpha=0.7, color='r')
-    axes[row, col].set_xlabel('Time (Seconds)')
-    axes[row, col].set_ylabel('Frequency')
-    axes[row, col].set_title(f'Predicted {alarm_labels[i]}')
-
-# Hide the last unused subplot if the number of alarms is odd
-if len(alarms) % 2 != 0:
-    axes[2, 1].axis('off')
-
-plt.tight_layout(rect=[0, 0, 1, 0.95])
-plt.show()
+import argparse
+from datetime import datetime, timedelta
+
+import forecast
+import storage
+
+# Trains the alarm forecast model and stores it as a new version in the
+# models directory, where the running server picks it up (see /predict).
+# Only a recent window of readings is used, so run time does not grow with the table.
+# With --incremental only the readings since the last version are learnt from,
+# cheap enough to run every hour.
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Train the alarm forecast model.')
+    parser.add_argument('--database', default='instance/sensor_data.db', help='SQLite database file')
+    parser.add_argument('--archive-dir', default='instance/archive', help='Archived readings, used if the window reaches them')
+    parser.add_argument('--models-dir', default='instance/models', help='Where model versions are stored')
+    parser.add_argument('--days', type=float, default=7, help='Train on the readings of this many past days')
+    parser.add_argument('--horizon', type=int, default=forecast.HORIZON, help='Seconds ahead the model forecasts')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Add trees for the new readings to the newest version instead of training from scratch')
+    parser.add_argument('--estimators', type=int, default=forecast.N_ESTIMATORS, help='Trees of a full training')
+    parser.add_argument('--add-estimators', type=int, default=forecast.ADD_ESTIMATORS, help='Trees added by --incremental')
+    parser.add_argument('--jobs', type=int, default=-1, help='CPU cores to train on, -1 for all')
+    args = parser.parse_args(argv)
+
+    # Connect to the SQLite database read-only, so training never holds up the server's writes
+    engine = storage.create_reader_engine(f'sqlite:///{args.database}', pool_size=1)
+
+    previous = forecast.load_model(args.models_dir) if args.incremental else None
+    if previous is not None and previous.get('format') != forecast.MODEL_FORMAT:
+        print(f"Model v{previous['version']} was trained by an older version, training from scratch")
+        previous = None
+
+    if previous is not None:
+        since = datetime.utcfromtimestamp(previous['trained_until'] - forecast.CONTEXT_SECONDS)
+        columns = forecast.load_training_columns(engine, args.archive_dir, since)
+        bundle = forecast.update(previous, columns, args.add_estimators, args.jobs) if len(columns['timestamp']) else None
+        if bundle is None:
+            raise SystemExit(f"No new readings since model v{previous['version']}, nothing to do")
+    else:
+        since = datetime.utcnow() - timedelta(days=args.days)
+        columns = forecast.load_training_columns(engine, args.archive_dir, since)
+        if not len(columns['timestamp']):
+            raise SystemExit(f"No readings since {since:%Y-%m-%d %H:%M:%S}, nothing to train on")
+        bundle = forecast.train(columns, args.horizon, args.estimators, args.jobs)
+
+    report = bundle['report']
+    for alarm, accuracy in report['accuracy'].items():
+        print(f"{alarm} Model Accuracy: {accuracy}")
+    print(f"{report['mode'].capitalize()} training on {report['rows']} readings ({report['test_rows']} tested), "
+          f"{report['estimators']} trees, {report['wall_seconds']} s, peak memory {report['peak_memory_mb']} MB")
+
+    version = forecast.save_model(bundle, args.models_dir)
+    print(f"Saved forecast model v{version} to {args.models_dir}")
+
+
+if __name__ == '__main__':
+    main()
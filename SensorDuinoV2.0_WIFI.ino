@@ -9,10 +9,34 @@
 #include <string.h>
 #include <WiFi.h>
 #include <HTTPClient.h>
+#include <time.h>
 
 ////////////WiFi Config////////////
 
-const char* serverURL = "http://192.168.116.250:8080/sensor-data";
+const char* serverURL = "http://192.168.116.250:8080/receive_batch";
+
+////////////Batch Upload Config////////////
+// Readings are buffered and uploaded together as packed binary records,
+// layout must match BATCH_RECORD in ingest.py (6 x float32 + uint32, little-endian)
+#define BATCH_CAPACITY 120             // Records kept while the server is unreachable
+const uint32_t uploadInterval = 60000; // Upload buffered readings every minute (ms)
+
+typedef struct __attribute__((packed)) batch_record {
+  float temperature;
+  float humidity;
+  float pressure;
+  float light;
+  float gas;
+  float CH2O;
+  uint32_t timestamp; // Unix time, or before NTP has synced the age in ms at upload (MIN_CLOCK_TIME in ingest.py)
+} batch_record;
+
+#define MIN_CLOCK_TIME 1000000000UL    // Smaller time fields are read as ages by the server
+
+batch_record batchBuffer[BATCH_CAPACITY];
+uint32_t capturedAt[BATCH_CAPACITY];   // millis() when each buffered reading was taken
+int batchCount = 0;
+uint32_t lastUpload = 0;
 
 typedef struct struct_message { // Message Container
   float temperature;
@@ -72,6 +96,9 @@ void setup() {
   Serial.println("Connection established!");   
   Serial.print("IP address:    ");             
   Serial.println(WiFi.localIP());   
+
+  ////Sync the clock so buffered readings keep their own timestamps////
+  configTime(0, 0, "pool.ntp.org");
 }
 
 void loop() {
@@ -187,32 +214,56 @@ void loop() {
   ringMeter(SHT30_Humidity_Level,1,100,      100,200,50,"Humidity",RED2RED); // Draw analogue meter
   ringMeter(HP203N_Pressure_kPa,98,102,     200,200,50,"Pressure",RED2GREEN); // Draw analogue meter
 
-  // Send readings to Laptop via HTTP Post
-  if (WiFi.status() == WL_CONNECTED) {
-    HTTPClient http;
-    http.begin(serverURL);
-    http.addHeader("Content-Type", "application/json");
-
-    String jsonData = "{";
-    jsonData += "\"temperature\":" + String(SHT30_Temp_C) + ",";
-    jsonData += "\"humidity\":" + String(SHT30_Humidity_Level) + ",";
-    jsonData += "\"pressure\":" + String(HP203N_Pressure_kPa) + ",";
-    jsonData += "\"light\":" + String(BH1750_Luminosity_lux) + ",";
-    jsonData += "\"gas\":" + String(MQ2_Gas_Level) + ",";
-    jsonData += "\"CH2O\":" + String(ZE08_CH2O_mgm3);
-    jsonData += "}";
-
-    int httpResponseCode = http.POST(jsonData);
-
-    if (httpResponseCode > 0) {
-      Serial.printf("HTTP Response code: %d\n", httpResponseCode);
+  // Buffer the readings, drop the oldest one if the buffer is full
+  if (batchCount == BATCH_CAPACITY) {
+    memmove(&batchBuffer[0], &batchBuffer[1], (BATCH_CAPACITY - 1) * sizeof(batch_record));
+    memmove(&capturedAt[0], &capturedAt[1], (BATCH_CAPACITY - 1) * sizeof(uint32_t));
+    batchCount--;
+  }
+  time_t now = time(nullptr);
+  capturedAt[batchCount] = millis();
+  batch_record &record = batchBuffer[batchCount++];
+  record.temperature = SHT30_Temp_C;
+  record.humidity = SHT30_Humidity_Level;
+  record.pressure = HP203N_Pressure_kPa;
+  record.light = BH1750_Luminosity_lux;
+  record.gas = MQ2_Gas_Level;
+  record.CH2O = ZE08_CH2O_mgm3;
+  record.timestamp = now > 1700000000 ? (uint32_t)now : 0;
+
+  // Send buffered readings to Laptop via one HTTP Post per upload interval
+  if (millis() - lastUpload >= uploadInterval) {
+    lastUpload = millis();
+    if (WiFi.status() == WL_CONNECTED) {
+      HTTPClient http;
+      http.begin(serverURL);
+      http.addHeader("Content-Type", "application/octet-stream");
+      http.addHeader("X-Device-ID", WiFi.macAddress()); // Identifies this board on the server
+
+      // Readings taken without a clock carry their age, so the server can date them
+      uint32_t uploadMillis = millis();
+      for (int i = 0; i < batchCount; i++) {
+        if (batchBuffer[i].timestamp < MIN_CLOCK_TIME) {
+          batchBuffer[i].timestamp = uploadMillis - capturedAt[i];
+        }
+      }
+
+      int httpResponseCode = http.POST((uint8_t*)batchBuffer, batchCount * sizeof(batch_record));
+
+      if (httpResponseCode == 200) {
+        Serial.printf("Uploaded %d readings: %s\n", batchCount, http.getString().c_str());
+        batchCount = 0;
+      } else if (httpResponseCode > 0) {
+        // Keep the buffer on 503 (server busy) or other errors and retry next interval
+        Serial.printf("HTTP Response code: %d\n", httpResponseCode);
+      } else {
+        Serial.printf("Error occurred while sending HTTP POST: %s\n", http.errorToString(httpResponseCode).c_str());
+      }
+
+      http.end();
     } else {
-      Serial.printf("Error occurred while sending HTTP POST: %s\n", http.errorToString(httpResponseCode).c_str());
+      Serial.println("WiFi Disconnected");
     }
-
-    http.end();
-  } else {
-    Serial.println("WiFi Disconnected");
   }
 
   delay(3000);
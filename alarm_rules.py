@@ -0,0 +1,218 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Sensor column -> alarm flag column it drives
+ALARM_FLAGS = {
+    'temperature': 'temp_alarm',
+    'humidity': 'humidity_alarm',
+    'pressure': 'pressure_alarm',
+    'light': 'light_alarm',
+    'tvoc': 'tvoc_alarm',
+    'smoke': 'smoke_alarm'
+}
+
+# Used when no rules file exists, same limits the server always had (no limit for light)
+DEFAULT_RULES = {
+    'default': {
+        'temperature': {'min': 10, 'max': 30},
+        'humidity': {'min': 40},
+        'pressure': {'min': 100},
+        'tvoc': {'max': 0.1},
+        'smoke': {'max': 35}
+    },
+    'devices': {}
+}
+
+# How often the rules file is checked for changes (seconds)
+RELOAD_INTERVAL = 5.0
+
+EPOCH = datetime(1970, 1, 1)
+
+
+# One sensor's rule. The alarm is raised once the value has been below `min` or
+# above `max` for at least `duration` seconds, and cleared only when the value
+# is back inside the limits by at least `hysteresis`.
+class Rule:
+    def __init__(self, min=None, max=None, hysteresis=0.0, duration=0.0):
+        self.min = -np.inf if min is None else float(min)
+        self.max = np.inf if max is None else float(max)
+        self.hysteresis = float(hysteresis)
+        self.duration = float(duration)
+
+
+# Carried between batches for every (device, sensor)
+class SeriesState:
+    def __init__(self):
+        self.active = False
+        self.breach_since = np.nan  # Start of the breach run still going at the end of the last batch
+
+
+# Evaluates one sensor series (sorted by time) and updates its state, all in NumPy
+def evaluate_series(rule, timestamps, values, state):
+    count = len(values)
+    index = np.arange(count)
+
+    breach = (values < rule.min) | (values > rule.max)
+    clear = (values >= rule.min + rule.hysteresis) & (values <= rule.max - rule.hysteresis)
+
+    # Time each breach run started: a run starts where the previous reading did not breach,
+    # a run already going when the batch starts keeps its start from the previous batch
+    previous = np.concatenate(([not np.isnan(state.breach_since)], breach[:-1]))
+    run_start = np.where(breach & ~previous, timestamps, np.nan)
+    run_start = np.concatenate(([state.breach_since], run_start))
+    filled = np.maximum.accumulate(np.where(~np.isnan(run_start), np.arange(count + 1), 0))
+    run_start = run_start[filled][1:]
+
+    raised = breach & (timestamps - run_start >= rule.duration)
+
+    # Between events (raised / cleared) the alarm keeps its previous state
+    events = np.where(raised, 1, np.where(clear, -1, 0))
+    last_event = np.maximum.accumulate(np.where(events != 0, index + 1, 0))
+    active = np.where(last_event > 0, events[last_event - 1] == 1, state.active)
+
+    if count:
+        state.active = bool(active[-1])
+        state.breach_since = run_start[-1] if breach[-1] else np.nan
+    return active.astype(np.int8)
+
+
+# Per-device, per-sensor alarm rules loaded from a JSON file:
+#   {"default": {"smoke": {"max": 35, "duration": 10, "hysteresis": 2}, ...},
+#    "devices": {"90:38:0C:56:AD:B4": {"smoke": {"max": 40}}}}
+# Device entries override the default rule of the sensors they name.
+# The file is re-read when it changes, no restart needed.
+class AlarmRuleEngine:
+    def __init__(self, path=None, config=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._states = {}
+        self._mtime = None
+        self._checked = 0.0
+        self._load(config if config is not None else self._read_config())
+
+    def _read_config(self):
+        if self.path and os.path.exists(self.path):
+            self._mtime = os.path.getmtime(self.path)
+            with open(self.path) as f:
+                return json.load(f)
+        return DEFAULT_RULES
+
+    def _load(self, config):
+        self._default = {sensor: Rule(**rule) for sensor, rule in config.get('default', {}).items()}
+        self._devices = {
+            device: {sensor: Rule(**{**config.get('default', {}).get(sensor, {}), **rule})
+                     for sensor, rule in rules.items()}
+            for device, rules in config.get('devices', {}).items()
+        }
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if not self.path or now - self._checked < RELOAD_INTERVAL:
+            return
+        self._checked = now
+        try:
+            if os.path.exists(self.path) and os.path.getmtime(self.path) != self._mtime:
+                self._load(self._read_config())
+                logger.info("Reloaded alarm rules from %s", self.path)
+        except (OSError, ValueError, TypeError) as e:
+            logger.error("Failed to reload alarm rules, keeping the previous ones: %s", e)
+
+    def rules_for(self, device):
+        rules = dict(self._default)
+        rules.update(self._devices.get(device, {}))
+        return rules
+
+    # Alarm flag arrays for one device's readings, sorted by time. Sensors
+    # without a rule get all-zero flags; NaN values neither raise nor clear an alarm.
+    def evaluate_device(self, device, timestamps, columns):
+        rules = self.rules_for(device)
+        flags = {}
+        for sensor, flag in ALARM_FLAGS.items():
+            rule = rules.get(sensor)
+            if rule is None:
+                flags[flag] = np.zeros(len(timestamps), dtype=np.int8)
+                continue
+            state = self._states.setdefault((device, sensor), SeriesState())
+            flags[flag] = evaluate_series(rule, timestamps, columns[sensor], state)
+        return flags
+
+    # Set the alarm flags of a batch of SensorData rows in place
+    def evaluate(self, rows):
+        if not rows:
+            return rows
+        self.maybe_reload()
+
+        timestamps = np.array([(row['timestamp'] - EPOCH).total_seconds() for row in rows])
+        devices = np.array([row['device_id'] for row in rows])
+        columns = {sensor: np.array([row[sensor] for row in rows], dtype=np.float64) for sensor in ALARM_FLAGS}
+
+        # Per device, in time order
+        order = np.lexsort((timestamps, devices))
+        sorted_devices = devices[order]
+        boundaries = np.flatnonzero(sorted_devices[1:] != sorted_devices[:-1]) + 1
+
+        with self._lock:
+            for positions in np.split(order, boundaries):
+                device = str(devices[positions[0]])
+                flags = self.evaluate_device(
+                    device, timestamps[positions], {sensor: values[positions] for sensor, values in columns.items()})
+                for flag, values in flags.items():
+                    for position, value in zip(positions, values):
+                        rows[position][flag] = int(value)
+        return rows
+
+
+# SQLAlchemy is only imported by reevaluate_history, so the ingest workers load without it
+REEVALUATE_CHUNK = (
+    "SELECT id, timestamp, " + ", ".join(ALARM_FLAGS) + ", " + ", ".join(ALARM_FLAGS.values())
+    + " FROM sensor_data WHERE device_id = :device_id"
+    " AND (timestamp > :timestamp OR (timestamp = :timestamp AND id > :id))"
+    " ORDER BY timestamp, id LIMIT :limit"
+)
+
+UPDATE_FLAGS = (
+    "UPDATE sensor_data SET " + ", ".join(f"{flag} = :{flag}" for flag in ALARM_FLAGS.values()) + " WHERE id = :id"
+)
+
+
+# Re-run the current rules over every stored reading of the given devices, in
+# time order and chunk by chunk, and rewrite the flags that changed.
+# Returns the number of readings whose flags changed.
+def reevaluate_history(engine, rules, devices, chunk_size=50000):
+    from sqlalchemy import text
+
+    changed = 0
+    for device in devices:
+        timestamp, last_id = '', 0
+        while True:
+            with engine.begin() as connection:
+                rows = connection.execute(text(REEVALUATE_CHUNK), {
+                    'device_id': device, 'timestamp': timestamp, 'id': last_id, 'limit': chunk_size
+                }).fetchall()
+                if not rows:
+                    break
+
+                data = np.array([row[2:] for row in rows], dtype=np.float64)
+                times = np.array([row[1] for row in rows], dtype='datetime64[us]').astype(np.int64) / 1e6
+                columns = {sensor: data[:, index] for index, sensor in enumerate(ALARM_FLAGS)}
+                flags = rules.evaluate_device(device, times, columns)
+
+                stored = data[:, len(ALARM_FLAGS):].astype(np.int8)
+                computed = np.column_stack([flags[flag] for flag in ALARM_FLAGS.values()])
+                updates = [
+                    {'id': rows[position][0], **dict(zip(ALARM_FLAGS.values(), map(int, computed[position])))}
+                    for position in np.flatnonzero((stored != computed).any(axis=1))
+                ]
+                if updates:
+                    connection.execute(text(UPDATE_FLAGS), updates)
+                changed += len(updates)
+                timestamp, last_id = rows[-1][1], rows[-1][0]
+    return changed
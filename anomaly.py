@@ -0,0 +1,191 @@
+import math
+import threading
+from collections import namedtuple
+from datetime import datetime
+from operator import itemgetter
+
+from history import SENSOR_COLUMNS
+
+# Streaming anomaly detection for every (device, sensor) series, in constant
+# memory per series and one pass per reading:
+#   outlier   the value is more than OUTLIER_Z robust standard deviations
+#             (1.4826 * MAD around the median of the last WINDOW readings) away
+#             from that median; robust, so a spike does not hide the next one
+#   drift     the EWMA of the series has moved more than DRIFT_Z long-run
+#             standard deviations (Welford mean / variance) away from the
+#             long-run mean; outliers and drifting readings are kept out of
+#             the long-run statistics so a slow shift cannot widen its own
+#             threshold, until it has lasted DRIFT_WARMUP readings and becomes
+#             the new normal
+#   flatline  the exact same value `flatline` readings in a row (a frozen
+#             ZE08, a stuck ADC; live sensors always jitter in the last digit)
+#   rate      the value changed faster than `max_rate` units per second
+#             (the MQ2 gas reading jumping)
+# The result is a bitmask stored with every reading in SensorData.anomaly_flags:
+# four bits per sensor, in the order of SENSOR_COLUMNS, see flag() and describe().
+
+OUTLIER = 1
+DRIFT = 2
+FLATLINE = 4
+RATE = 8
+KINDS = (('outlier', OUTLIER), ('drift', DRIFT), ('flatline', FLATLINE), ('rate', RATE))
+BITS_PER_SENSOR = 4
+
+WINDOW = 32  # Readings in the ring buffer the median and MAD are taken over
+MAD_REFRESH = 4  # The median and MAD of a series are recomputed every this many readings
+WARMUP = 32  # Readings a series needs before outliers and rates are flagged
+DRIFT_WARMUP = 500  # ... and long-run samples before drift is, they need more
+OUTLIER_Z = 6.0
+DRIFT_Z = 3.0  # Long-run deviations of the EWMA, which averages the noise away; a daily cycle peaks at 1.4
+EWMA_ALPHA = 0.05
+MAD_TO_SIGMA = 1.4826
+EPOCH = datetime(1970, 1, 1)
+
+# resolution: smallest meaningful change, the floor of the deviations outliers and drift are measured in
+# max_rate:   largest plausible change per second, None for no limit
+# flatline:   identical readings in a row that count as stuck, None for never
+SensorLimits = namedtuple('SensorLimits', ('resolution', 'max_rate', 'flatline'))
+
+LIMITS = {
+    'temperature': SensorLimits(0.05, 0.5, 900),
+    'humidity': SensorLimits(0.1, 2.0, 900),
+    'pressure': SensorLimits(0.01, 0.05, 900),
+    'light': SensorLimits(1.0, None, None),  # Lights switch on and off, and stay dark all night
+    'tvoc': SensorLimits(0.001, 0.05, 300),
+    'smoke': SensorLimits(0.1, 5.0, 300),
+}
+
+
+# Bit of one kind of anomaly on one sensor
+def flag(sensor, kind):
+    return kind << (BITS_PER_SENSOR * SENSOR_COLUMNS.index(sensor))
+
+
+# {sensor: [kind, ...]} for the bits set in a bitmask
+def describe(flags):
+    result = {}
+    for index, sensor in enumerate(SENSOR_COLUMNS):
+        bits = (flags >> (BITS_PER_SENSOR * index)) & 0xF
+        if bits:
+            result[sensor] = [name for name, kind in KINDS if bits & kind]
+    return result
+
+
+class SeriesState:
+    __slots__ = ('count', 'samples', 'mean', 'm2', 'ewma', 'drift_run', 'last_value', 'last_time', 'flat_run',
+                 'ring', 'median', 'scale')
+
+    # Memory per series: the ring buffer of WINDOW floats plus a handful of numbers
+
+    def __init__(self):
+        self.count = 0
+        self.samples = 0  # Welford count, running mean and sum of squared deviations
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.ewma = 0.0
+        self.drift_run = 0
+        self.last_value = None
+        self.last_time = None
+        self.flat_run = 0
+        self.ring = [0.0] * WINDOW
+        self.median = 0.0
+        self.scale = 0.0  # Robust standard deviation, 1.4826 * MAD
+
+    # Returns the kinds of anomaly (OUTLIER | DRIFT | ...) of the new value
+    def update(self, value, timestamp, limits, refresh):
+        kinds = 0
+        count = self.count
+
+        if count >= WARMUP:
+            if abs(value - self.median) > OUTLIER_Z * max(self.scale, limits.resolution):
+                kinds |= OUTLIER
+            if limits.max_rate is not None and timestamp > self.last_time and \
+                    abs(value - self.last_value) > limits.max_rate * (timestamp - self.last_time):
+                kinds |= RATE
+
+        if value == self.last_value:
+            self.flat_run += 1
+            if limits.flatline is not None and self.flat_run >= limits.flatline:
+                kinds |= FLATLINE
+        else:
+            self.flat_run = 0
+
+        self.ewma = value if count == 0 else self.ewma + EWMA_ALPHA * (value - self.ewma)
+        samples = self.samples
+        if samples >= DRIFT_WARMUP and \
+                abs(self.ewma - self.mean) > DRIFT_Z * max(math.sqrt(self.m2 / (samples - 1)), limits.resolution):
+            kinds |= DRIFT
+            self.drift_run += 1
+            if self.drift_run >= DRIFT_WARMUP:
+                # The level has moved for good: start the long-run statistics over from here
+                self.samples = 0
+                self.mean = self.m2 = 0.0
+                self.drift_run = 0
+        else:
+            self.drift_run = 0
+            if not kinds & OUTLIER:
+                # Welford's update of the long-run mean and variance
+                samples += 1
+                delta = value - self.mean
+                self.mean += delta / samples
+                self.m2 += delta * (value - self.mean)
+                self.samples = samples
+
+        count += 1
+        self.ring[(count - 1) % WINDOW] = value
+        # Refreshing the median and MAD every few readings keeps the per-reading cost low;
+        # `refresh` staggers the sensors of a device so they do not all sort at once
+        if count <= WARMUP or (count + refresh) % MAD_REFRESH == 0:
+            window = sorted(self.ring[:count] if count < WINDOW else self.ring)
+            middle = len(window) // 2
+            self.median = window[middle]
+            deviations = sorted([abs(item - self.median) for item in window])
+            self.scale = MAD_TO_SIGMA * deviations[middle]
+
+        self.count = count
+        self.last_value = value
+        self.last_time = timestamp
+        return kinds
+
+
+# Per-device, per-sensor detector state; process() sets row['anomaly_flags'].
+# A batch is taken in time order, as the alarm rules do, so its result matches
+# streaming the same readings one by one; a reading older than the newest one
+# of an earlier batch is stored unflagged and does not change the statistics.
+class AnomalyDetector:
+    def __init__(self, limits=None):
+        self.limits = [(sensor, (limits or LIMITS)[sensor], index * BITS_PER_SENSOR, index)
+                       for index, sensor in enumerate(SENSOR_COLUMNS)]
+        self._lock = threading.Lock()
+        self._devices = {}  # device -> [SeriesState per sensor]
+        self._reported = {}  # device -> flags of the last report()
+
+    def process(self, rows):
+        # Stable, so readings with equal timestamps keep their order in the batch
+        ordered = sorted(rows, key=itemgetter('timestamp')) if len(rows) > 1 else rows
+        with self._lock:
+            for row in ordered:
+                states = self._devices.get(row['device_id'])
+                if states is None:
+                    states = self._devices[row['device_id']] = [SeriesState() for _ in SENSOR_COLUMNS]
+                timestamp = (row['timestamp'] - EPOCH).total_seconds()
+                flags = 0
+                if states[0].last_time is None or timestamp >= states[0].last_time:
+                    for sensor, limits, shift, index in self.limits:
+                        flags |= states[index].update(row[sensor], timestamp, limits, index) << shift
+                row['anomaly_flags'] = flags
+        return rows
+
+    # Dashboard notice for the anomalies of a device's latest readings, or None when
+    # they are the same as last time: a stuck sensor is reported once, not every reading
+    def report(self, device, timestamp, flags):
+        with self._lock:
+            if self._reported.get(device, 0) == flags:
+                return None
+            self._reported[device] = flags
+        return {
+            'device': device,
+            'anomaly_flags': flags,
+            'anomalies': describe(flags),
+            'timestamp': timestamp.strftime("%Y-%m-%d %H:%M:%S")
+        }
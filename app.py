@@ -3,247 +3,367 @@ import eventlet
 # Monkey patch eventlet before importing anything else
 eventlet.monkey_patch()
 
+import atexit
+import ipaddress
+import logging
+import os
+import signal
+import sys
 import threading
-from flask import Flask, request, render_template
-from flask_socketio import SocketIO, emit
-from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime, timedelta
+import click
+from flask import Flask, Response, request, render_template
+from flask_socketio import SocketIO, join_room, leave_room, rooms
 from flask_migrate import Migrate  # Use Flask-Migrate for future schema updates
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import json
-from datetime import datetime
+
+import alarm_rules
+import anomaly
+import archive
+import features
+import forecast
+import history
+import http_ingest
+import metrics
+import profiler
+import rollups
+import storage
+import store
+from broadcaster import CoalescingBroadcaster, device_room
+from ingest import MAX_REQUEST_BYTES, IngestPipeline, reading_payload
+from ingest_queue import IngestQueue
+from latest_cache import LatestCache
+from models import DATABASE_URI, db
 
 app = Flask(__name__)
 
 app.config['SECRET_KEY'] = 'secret!'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///sensor_data.db'  # SQLite database
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI  # SQLite database
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-socketio = SocketIO(app, cors_allowed_origins="*")  # Allow cross-origin requests
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)  # Initialize Flask-Migrate
-
-# Define SensorData model with detailed alarm flags
-class SensorData(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    temperature = db.Column(db.Float, nullable=False)
-    humidity = db.Column(db.Float, nullable=False)
-    pressure = db.Column(db.Float, nullable=False)
-    light = db.Column(db.Float, nullable=False)
-    tvoc = db.Column(db.Float, nullable=False)
-    smoke = db.Column(db.Float, nullable=False)
-
-    # Individual alarm flags for each sensor
-    temp_alarm = db.Column(db.Integer, nullable=False, default=0)
-    humidity_alarm = db.Column(db.Integer, nullable=False, default=0)
-    pressure_alarm = db.Column(db.Integer, nullable=False, default=0)
-    light_alarm = db.Column(db.Integer, nullable=False, default=0)
-    tvoc_alarm = db.Column(db.Integer, nullable=False, default=0)
-    smoke_alarm = db.Column(db.Integer, nullable=False, default=0)
-
-    # Timestamp to indicate the live time for the data
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-
-# Create the database and tables
+# Where live readings are kept, see store.py: 'sqlite' (the SensorData tables) or
+# 'columns' (memory-mapped column files in COLUMN_STORE_DIR). The maintenance
+# commands and Predict.py work on the SQLite tables only.
+app.config['STORAGE_BACKEND'] = 'sqlite'
+app.config['COLUMN_STORE_DIR'] = os.path.join(app.instance_path, 'columns')
+# Read-only connections shared by the dashboard routes, see storage.py
+app.config['SQLITE_READ_POOL_SIZE'] = 8
+app.config['SQLITE_CHECKPOINT_INTERVAL'] = 60.0  # Seconds between WAL checkpoints
+# Write-behind ingestion: rows are flushed in bulk when either limit is reached
+app.config['INGEST_QUEUE_SIZE'] = 10000  # Readings held in memory before answering 503
+app.config['INGEST_BATCH_SIZE'] = 500  # Rows per bulk insert
+app.config['INGEST_FLUSH_INTERVAL'] = 0.25  # Seconds a reading may wait before being flushed
+# Dashboards get at most one frame per device per interval (seconds), carrying the newest reading
+app.config['SOCKETIO_COALESCE_INTERVAL'] = 1.0
+# Redis URL (or the stand-in in message_broker.py) shared by every process that emits to
+# dashboards: several web workers and the `cli.py ingest` writer. None: this process only
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None
+# Largest request body, a full /receive_batch upload; Flask answers 413 beyond it
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+# Upper bound for /history?max_points=
+app.config['HISTORY_MAX_POINTS'] = 10000
+# Raw readings older than this many days are moved to compressed archives by `flask archive`
+app.config['RETENTION_DAYS'] = 30
+app.config['ARCHIVE_DIR'] = os.path.join(app.instance_path, 'archive')
+# Per-device alarm thresholds, hysteresis and durations; edits are picked up without a restart
+app.config['ALARM_RULES_PATH'] = os.path.join(app.root_path, 'alarm_rules.json')
+# Versioned forecast models written by Predict.py, the newest one is loaded while running
+app.config['FORECAST_MODELS_DIR'] = os.path.join(app.instance_path, 'models')
+app.config['FORECAST_INTERVAL'] = 5.0  # Seconds between forecast refreshes of the devices that reported
+app.config['FORECAST_THRESHOLD'] = 0.5  # Probability from which an alarm counts as predicted
+# True when readings are written by separate `python cli.py ingest` processes: the
+# newest reading is then always looked up in the store instead of the in-process cache
+app.config['EXTERNAL_INGEST'] = False
+# DEBUG adds every reading and every HTTP request to the log
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO')
+# /debug/profiler lets the sampling profiler be switched on and off while the server runs.
+# Off unless PROFILER_ENABLED=1 is set, and even then only answered on the loopback interface
+app.config['PROFILER_ENABLED'] = os.environ.get('PROFILER_ENABLED', '') in ('1', 'true', 'yes')
+
+logging.basicConfig(level=app.config['LOG_LEVEL'], format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+socketio = SocketIO(app, cors_allowed_origins="*",  # Allow cross-origin requests
+                    message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'])
+db.init_app(app)
+# Batch mode lets Alembic rebuild SQLite tables for ALTER operations it cannot do in place
+migrate = Migrate(app, db, render_as_batch=True)  # Initialize Flask-Migrate
+
+# Create the database and tables (existing databases are upgraded with `flask db upgrade`).
+# db.engine is only used for this and the maintenance commands; it gets the WAL pragmas too.
 with app.app_context():
+    storage.configure(db.engine)
     db.create_all()
+    database_url = db.engine.url
+
+# Live readings are written by the ingest queue only and read by the dashboard routes
+sensor_store = store.open_store(
+    app.config['STORAGE_BACKEND'],
+    database_url=database_url,
+    directory=app.config['COLUMN_STORE_DIR'],
+    read_pool_size=app.config['SQLITE_READ_POOL_SIZE'],
+    checkpoint_interval=app.config['SQLITE_CHECKPOINT_INTERVAL']
+)
+sensor_store.start()
+
+ingest_queue = IngestQueue(
+    sensor_store.append,
+    max_size=app.config['INGEST_QUEUE_SIZE'],
+    batch_size=app.config['INGEST_BATCH_SIZE'],
+    flush_interval=app.config['INGEST_FLUSH_INTERVAL']
+)
+ingest_queue.start()
+metrics.QUEUE_DEPTH.set_function(ingest_queue.depth)
+# Flush whatever is still queued when the process exits, then close the store
+# (registered first so it runs after the queue has stopped)
+atexit.register(sensor_store.close)
+atexit.register(ingest_queue.stop)
 
 # Serve the HTML page
 @app.route('/')
 def index():
     return render_template('index.html')
 
+# Live readings are pushed to the room of the board they came from, coalesced per interval
+broadcaster = CoalescingBroadcaster(
+    lambda event, payload, room: socketio.emit(event, payload, to=room),
+    interval=app.config['SOCKETIO_COALESCE_INTERVAL']
+)
+broadcaster.start()
+atexit.register(broadcaster.stop)
+
+# A dashboard follows one board at a time
+@socketio.on('subscribe')
+def subscribe(message):
+    device = (message or {}).get('device')
+    if not device:
+        return
+    for room in rooms():
+        if room.startswith('device:'):
+            leave_room(room)
+    join_room(device_room(device))
+
+# Newest reading per device, served by /get_latest_data without a database query
+latest_cache = LatestCache()
+
+# Alarm forecasts per device; dashboards are told when the predicted alarms change
+forecaster = forecast.ForecastService(
+    app.config['FORECAST_MODELS_DIR'],
+    lambda payload: socketio.emit('predicted_alarm', payload, to=device_room(payload['device'])),
+    interval=app.config['FORECAST_INTERVAL'],
+    threshold=app.config['FORECAST_THRESHOLD']
+)
+forecaster.start()
+atexit.register(forecaster.stop)
+
+# Outliers, drift, flatlines and jumps per device and sensor; dashboards are told when they change
+anomaly_detector = anomaly.AnomalyDetector()
+
+# One ingestion pipeline shared by the Flask route and the port-8080 server
+pipeline = IngestPipeline(ingest_queue, broadcaster.publish, latest_cache,
+                          alarm_rules.AlarmRuleEngine(app.config['ALARM_RULES_PATH']), forecaster,
+                          anomaly_detector,
+                          lambda report: socketio.emit('sensor_anomaly', report, to=device_room(report['device'])))
+
 # Endpoint to receive sensor data via HTTP POST
 @app.route('/receive_data', methods=['POST'])
 def receive_data():
-    if request.method == 'POST':
-        try:
-            # Log incoming request details
-            print(f"Headers: {request.headers}")
-            print(f"Content Length: {request.content_length}")
-            print(f"Raw Data: {request.data}")
-
-            # Parse the incoming JSON data
-            sensor_data = request.get_json()
-
-            if sensor_data is None:
-                print("No JSON data received.")
-                return "Invalid data format", 400
-
-            # Extract sensor data fields
-            temperature = sensor_data.get('temperature')
-            humidity = sensor_data.get('humidity')
-            pressure = sensor_data.get('pressure')
-            light = sensor_data.get('light', 0.0)  # Assuming light data might not be present
-            tvoc = sensor_data.get('CH2O')  # Assuming CH2O corresponds to TVOC in mg/m3
-            smoke = sensor_data.get('gas')
-
-            # Log the received data
-            print(f"Received sensor data: {sensor_data}")
-
-            # Determine each sensor's alarm flag
-            temp_alarm = 1 if temperature < 10 or temperature > 30 else 0
-            humidity_alarm = 1 if humidity < 40 else 0
-            pressure_alarm = 1 if pressure < 100 else 0
-            light_alarm = 0  # No alarm limit for light as specified
-            tvoc_alarm = 1 if tvoc > 0.1 else 0
-            smoke_alarm = 1 if smoke > 35 else 0
-
-            # Create new SensorData instance and add to the database
-            try:
-                with app.app_context():
-                    new_data = SensorData(
-                        temperature=temperature,
-                        humidity=humidity,
-                        pressure=pressure,
-                        light=light,
-                        tvoc=tvoc,
-                        smoke=smoke,
-                        temp_alarm=temp_alarm,
-                        humidity_alarm=humidity_alarm,
-                        pressure_alarm=pressure_alarm,
-                        light_alarm=light_alarm,
-                        tvoc_alarm=tvoc_alarm,
-                        smoke_alarm=smoke_alarm,
-                        timestamp=datetime.utcnow()
-                    )
-                    db.session.add(new_data)
-                    db.session.commit()
-                    print("Data successfully committed to the database")
-            except Exception as db_error:
-                print(f"Failed to commit data to the database: {db_error}")
-
-            # Emit the data to all connected clients
-            try:
-                socketio.emit('sensor_data', {
-                    'temperature': temperature,
-                    'humidity': humidity,
-                    'pressure': pressure,
-                    'light': light,
-                    'tvoc': tvoc,
-                    'smoke': smoke
-                })
-                print("Emitting sensor data via WebSocket")
-            except Exception as emit_error:
-                print(f"Failed to emit data via WebSocket: {emit_error}")
-
-            return "Data received successfully", 200
-        except Exception as e:
-            print(f"Failed to process data: {e}")
-            return "Invalid data format", 400
-
-# HTTP Server to receive data from sensor
-class RequestHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        # Send a simple response for GET requests
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
-        self.wfile.write(b"GET request handled successfully")
-
-    def do_POST(self):
-        try:
-            # Log headers and content length for debugging
-            print(f"Headers: {self.headers}")
-            content_length = int(self.headers['Content-Length'])  # Get the size of the data
-            print(f"Content Length: {content_length}")
-
-            post_data = self.rfile.read(content_length)  # Read the data
-            print(f"Raw Data: {post_data}")
-
-            # Parse the incoming JSON data
-            sensor_data = json.loads(post_data.decode('utf-8'))
-
-            # Extract sensor data fields
-            temperature = sensor_data.get('temperature')
-            humidity = sensor_data.get('humidity')
-            pressure = sensor_data.get('pressure')
-            light = sensor_data.get('light', 0.0)  # Assuming light data might not be present
-            tvoc = sensor_data.get('CH2O')  # Assuming CH2O corresponds to TVOC in mg/m3
-            smoke = sensor_data.get('gas')
-
-            # Log the received data
-            print(f"Received sensor data: {sensor_data}")
-            # Determine each sensor's alarm flag
-            temp_alarm = 1 if temperature < 10 or temperature > 30 else 0
-            humidity_alarm = 1 if humidity < 40 else 0
-            pressure_alarm = 1 if pressure < 100 else 0
-            light_alarm = 0  # No alarm limit for light as specified
-            tvoc_alarm = 1 if tvoc > 0.1 else 0
-            smoke_alarm = 1 if smoke > 35 else 0
-            # Use Flask app context to add data to the database
-            with app.app_context():
-                new_data = SensorData(
-                    temperature=temperature,
-                    humidity=humidity,
-                    pressure=pressure,
-                    light=light,
-                    tvoc=tvoc,
-                    smoke=smoke,
-                    temp_alarm=temp_alarm,
-                    humidity_alarm=humidity_alarm,
-                    pressure_alarm=pressure_alarm,
-                    light_alarm=light_alarm,
-                    tvoc_alarm=tvoc_alarm,
-                    smoke_alarm=smoke_alarm,
-                    timestamp=datetime.utcnow()
-                )
-                db.session.add(new_data)
-                db.session.commit()
-                print("Data successfully committed to the database")
-
-            # Emit the data to all connected clients
-            socketio.emit('sensor_data', {
-                'temperature': temperature,
-                'humidity': humidity,
-                'pressure': pressure,
-                'light': light,
-                'tvoc': tvoc,
-                'smoke': smoke
-            })
-            print("Emitting sensor data via WebSocket")
-
-            # Send a response back to the sensor
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(b"Data received successfully")
-        except json.JSONDecodeError:
-            print("Failed to decode JSON data")
-            self.send_response(400)
-            self.end_headers()
-
-# Run the HTTP server in a separate thread with correct app context
-def run_http_server():
-    with app.app_context():
-        server_address = ('', 8080)  # Listen on all available IP addresses, port 8080
-        httpd = HTTPServer(server_address, RequestHandler)
-        print("HTTP Server running on port 8080...")
-        httpd.serve_forever()
+    status, message, headers = pipeline.ingest_json(
+        request.get_data(), request.headers.get('X-Device-ID') or request.args.get('device'))
+    return message, status, headers
+
+# Endpoint to receive many readings per request, see ingest.BATCH_RECORD for the binary layout
+@app.route('/receive_batch', methods=['POST'])
+def receive_batch():
+    status, summary, headers = pipeline.ingest_batch(
+        request.get_data(), request.content_type or '',
+        request.headers.get('X-Device-ID') or request.args.get('device'))
+    return summary, status, headers
+
+# Run the concurrent HTTP server for the sensors in a separate thread
+def run_http_server(port=8080):
+    http_ingest.serve(pipeline, port=port)
 
 @app.route('/get_latest_data', methods=['GET'])
 def get_latest_data():
     try:
-        # Query the latest sensor data entry from the database
-        latest_data = SensorData.query.order_by(SensorData.id.desc()).first()
+        device = request.args.get('device')
 
-        if latest_data is None:
-            return {"error": "No data available"}, 404
+        # Serve from the in-memory snapshot, the database is only read after a restart
+        cached = None if app.config['EXTERNAL_INGEST'] else latest_cache.get(device)
+        if cached is None:
+            # Query the latest sensor data entry, for one board if asked for
+            latest_data = sensor_store.latest(device)
+            if not latest_data:
+                return {"error": "No data available"}, 404
 
-        # Create a dictionary to return as JSON
-        data = {
-            'temperature': latest_data.temperature,
-            'humidity': latest_data.humidity,
-            'pressure': latest_data.pressure,
-            'light': latest_data.light,
-            'tvoc': latest_data.tvoc,
-            'smoke': latest_data.smoke,
-            'timestamp': latest_data.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-        }
-
-        return data, 200
+            row = latest_data[0]
+            latest_cache.update(row['device_id'], row['timestamp'], reading_payload(row))
+            cached = latest_cache.get(row['device_id'])
+
+        etag, data = cached
+        headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+
+        # Unchanged since the dashboard's last poll
+        if request.if_none_match.contains(etag):
+            return '', 304, headers
+
+        return data, 200, headers
     except Exception as e:
-        print(f"Failed to retrieve data: {e}")
+        logger.exception("Failed to retrieve data: %s", e)
         return {"error": "Failed to retrieve data"}, 500
 
+# Historical readings of one device as downsampled columnar arrays
+@app.route('/history', methods=['GET'])
+def get_history():
+    device = request.args.get('device')
+    if not device:
+        return {"error": "Missing device"}, 400
+    try:
+        end = history.parse_time(request.args.get('to'), datetime.utcnow())
+        start = history.parse_time(request.args.get('from'), end - timedelta(days=1))
+        max_points = int(request.args.get('max_points', 1000))
+        max_points = max(1, min(max_points, app.config['HISTORY_MAX_POINTS']))
+    except (ValueError, OverflowError):  # OverflowError: ?to= at the first day datetime can hold
+        return {"error": "Invalid from, to or max_points"}, 400
+
+    try:
+        # Long windows are read from the rollups instead of the raw readings
+        resolution = history.pick_resolution(start, end, max_points, rollups.RESOLUTIONS.values())
+        if resolution is None:
+            # Raw readings may be split between the archive (older) and the live store
+            columns = history.concat_columns(
+                archive.read_columns(app.config['ARCHIVE_DIR'], start, end, device),
+                sensor_store.range_columns(device, start, end))
+        else:
+            columns = sensor_store.rollup_columns(device, resolution, rollups.bucket_start(start, resolution), end)
+    except Exception as e:
+        logger.exception("Failed to retrieve history: %s", e)
+        return {"error": "Failed to retrieve history"}, 500
+
+    header = {
+        'device': device,
+        'from': start.strftime("%Y-%m-%d %H:%M:%S"),
+        'to': end.strftime("%Y-%m-%d %H:%M:%S"),
+        'resolution': resolution or 'raw',
+        'rows': len(columns['timestamp'])
+    }
+    points = history.downsample(columns, max_points)
+    header['points'] = len(points['timestamp'])
+    return Response(history.stream_json(header, points), mimetype='application/json')
+
+# Which alarms a device is expected to raise within the model's horizon
+@app.route('/predict', methods=['GET'])
+def predict():
+    device = request.args.get('device')
+    if not device:
+        return {"error": "Missing device"}, 400
+    if not forecaster.ready:
+        return {"error": "No forecast model trained yet, run Predict.py"}, 503
+    try:
+        if not forecaster.has_device(device):
+            # Not seen since the server started, warm its rolling window from the database
+            forecaster.observe(sensor_store.latest(device, features.WINDOW))
+        elif app.config['EXTERNAL_INGEST']:
+            # Readings are written by `cli.py ingest`, catch up with what it stored since
+            last = forecaster.last_timestamp(device)
+            newest = sensor_store.latest(device)
+            if newest and newest[0]['timestamp'] > last:
+                forecaster.observe([row for row in sensor_store.latest(device, features.WINDOW)
+                                    if row['timestamp'] > last])
+
+        result = forecaster.forecast(device)
+        if result is None:
+            return {"error": "No data available"}, 404
+        return result
+    except Exception as e:
+        logger.exception("Failed to forecast alarms: %s", e)
+        return {"error": "Failed to forecast alarms"}, 500
+
+# Ingest timings and counters in the Prometheus text format
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+# CPU sampling profiler, see profiler.py. Needs PROFILER_ENABLED=1 in the environment
+# and a request from localhost, then stays off until started:
+#   POST /debug/profiler/start?interval=0.005   start sampling (seconds of CPU time between samples)
+#   GET  /debug/profiler                        status
+#   GET  /debug/profiler/stacks                 folded stacks sampled so far
+#   POST /debug/profiler/stop                   stop and return the folded stacks
+sampling_profiler = profiler.SamplingProfiler()
+
+def is_loopback(address):
+    try:
+        return ipaddress.ip_address(address or '').is_loopback
+    except ValueError:
+        return False
+
+@app.route('/debug/profiler', methods=['GET'])
+@app.route('/debug/profiler/<action>', methods=['GET', 'POST'])
+def debug_profiler(action=None):
+    if not app.config['PROFILER_ENABLED'] or not is_loopback(request.remote_addr):
+        return {"error": "Profiler disabled"}, 404
+    if not sampling_profiler.available:
+        return {"error": "Sampling profiler not available on this platform"}, 501
+
+    if action is None:
+        return sampling_profiler.status()
+    if action == 'stacks':
+        return Response(sampling_profiler.folded(), mimetype='text/plain')
+    if request.method != 'POST':
+        return {"error": "Use POST to start or stop the profiler"}, 405
+    if action == 'start':
+        try:
+            interval = float(request.args.get('interval', 0.005))
+        except ValueError:
+            return {"error": "Invalid interval"}, 400
+        if not 0.001 <= interval <= 1:
+            return {"error": "Interval must be between 0.001 and 1 seconds"}, 400
+        sampling_profiler.start(interval)
+        logger.info("Sampling profiler started, interval %s s", interval)
+        return sampling_profiler.status()
+    if action == 'stop':
+        folded = sampling_profiler.stop()
+        logger.info("Sampling profiler stopped after %d samples", sampling_profiler.samples)
+        return Response(folded, mimetype='text/plain')
+    return {"error": "Unknown action, expected stacks, start or stop"}, 404
+
+@app.cli.command('backfill-rollups')
+def backfill_rollups_command():
+    """Rebuild the 1-minute and 1-hour rollups from the raw readings."""
+    devices = rollups.backfill(db.engine)
+    print(f"Rebuilt rollups for {len(devices)} device(s)")
+
+@app.cli.command('archive')
+@click.option('--days', type=int, default=None, help='Keep this many days of raw readings in SQLite.')
+@click.option('--chunk-size', type=int, default=5000, help='Rows archived and deleted per transaction.')
+def archive_command(days, chunk_size):
+    """Move raw readings past the retention period into the compressed archive."""
+    days = app.config['RETENTION_DAYS'] if days is None else days
+    archived = archive.archive_older_than(db.engine, app.config['ARCHIVE_DIR'], days, chunk_size)
+    print(f"Archived {archived} reading(s) older than {days} days to {app.config['ARCHIVE_DIR']}")
+
+@app.cli.command('reevaluate-alarms')
+@click.option('--device', 'devices', multiple=True, help='Only this device (repeatable), default all.')
+def reevaluate_alarms_command(devices):
+    """Re-apply the current alarm rules to all stored readings and refresh the rollups."""
+    devices = list(devices) or rollups.list_devices(db.engine)
+    # A fresh engine, so no state from live ingestion leaks into the historical pass
+    rules = alarm_rules.AlarmRuleEngine(app.config['ALARM_RULES_PATH'])
+    changed = alarm_rules.reevaluate_history(db.engine, rules, devices)
+    rollups.backfill(db.engine, devices)
+    print(f"Updated alarm flags of {changed} reading(s) on {len(devices)} device(s)")
+
+# Dashboard and SocketIO server, plus the sensor server on sensor_port unless it is None
+def run(host='0.0.0.0', port=5000, sensor_port=8080, debug=True):
+    # SIGTERM (systemd, docker stop) exits through the atexit handlers above, so the
+    # write-behind queue flushes the readings it already acknowledged
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # The debug reloader runs this module twice; only the serving child may own the sensor port,
+    # otherwise readings sent there land in the watcher process and never reach dashboards
+    if sensor_port and (not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        threading.Thread(target=run_http_server, args=(sensor_port,), daemon=True).start()
+    # Eventlet's per-request access log only at DEBUG, like the port-8080 server's
+    socketio.run(app, debug=debug, host=host, port=port, log_output=app.config['LOG_LEVEL'] == 'DEBUG')
+
 if __name__ == '__main__':
-    threading.Thread(target=run_http_server, daemon=True).start()
-    socketio.run(app, debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    run()
\ No newline at end of file
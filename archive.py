@@ -0,0 +1,115 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import text
+
+from history import SENSOR_COLUMNS, db_time
+from rollups import ALARM_COLUMNS
+
+# Raw readings older than the retention period are moved out of SQLite into
+# compressed NumPy archives, one directory per UTC day:
+#   <archive_dir>/2026-10-18/part-<first id>-<last id>.npz
+# Each part holds the columns below for the rows of one archiving chunk.
+
+ARCHIVE_COLUMNS = ('id', 'device_id', 'timestamp') + SENSOR_COLUMNS + ALARM_COLUMNS + ('anomaly_flags',)
+
+SELECT_CHUNK = text(
+    "SELECT id, device_id, timestamp, "
+    + ", ".join(SENSOR_COLUMNS + ALARM_COLUMNS + ('anomaly_flags',))
+    + " FROM sensor_data WHERE timestamp < :cutoff ORDER BY id LIMIT :limit"
+)
+
+DELETE_CHUNK = text("DELETE FROM sensor_data WHERE id >= :first AND id <= :last AND timestamp < :cutoff")
+
+
+def _to_columns(rows):
+    columns = {
+        'id': np.array([row[0] for row in rows], dtype=np.int64),
+        'device_id': np.array([row[1] for row in rows], dtype='U32'),
+        # Parsed by NumPy rather than julianday() to keep full microsecond precision
+        'timestamp': np.array([row[2] for row in rows], dtype='datetime64[us]').astype(np.int64) / 1e6
+    }
+    for index, name in enumerate(SENSOR_COLUMNS, start=3):
+        columns[name] = np.array([row[index] for row in rows], dtype=np.float64)
+    for index, name in enumerate(ALARM_COLUMNS, start=3 + len(SENSOR_COLUMNS)):
+        columns[name] = np.array([row[index] for row in rows], dtype=np.int8)
+    columns['anomaly_flags'] = np.array([row[-1] for row in rows], dtype=np.uint32)
+    return columns
+
+
+def _write_partitions(archive_dir, columns):
+    days = (columns['timestamp'] // 86400).astype(np.int64)
+    for day in np.unique(days):
+        mask = days == day
+        partition = os.path.join(archive_dir, (datetime(1970, 1, 1) + timedelta(days=int(day))).strftime('%Y-%m-%d'))
+        os.makedirs(partition, exist_ok=True)
+        ids = columns['id'][mask]
+        path = os.path.join(partition, f'part-{ids[0]}-{ids[-1]}.npz')
+        # Write to a temporary file first so readers never see half a part
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as f:
+            np.savez_compressed(f, **{name: values[mask] for name, values in columns.items()})
+        os.replace(temporary, path)
+
+
+# Move rows older than `days` (counted from the start of today, UTC) into the archive, chunk by chunk.
+# Cutting at midnight keeps every rollup bucket either fully archived or fully live.
+# Every chunk is archived and deleted in its own short transaction followed by
+# a pause, so the ingestion writer keeps getting the database in between.
+# Re-running after a crash rewrites the same part files, no reading is lost.
+def archive_older_than(engine, archive_dir, days, chunk_size=5000, pause=0.05):
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    cutoff = db_time(today - timedelta(days=days))
+    archived = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(SELECT_CHUNK, {'cutoff': cutoff, 'limit': chunk_size}).fetchall()
+            if not rows:
+                break
+            columns = _to_columns(rows)
+            _write_partitions(archive_dir, columns)
+            connection.execute(DELETE_CHUNK, {'first': int(columns['id'][0]), 'last': int(columns['id'][-1]),
+                                              'cutoff': cutoff})
+        archived += len(rows)
+        time.sleep(pause)
+    return archived
+
+
+def _partition_paths(archive_dir, start, end):
+    if not os.path.isdir(archive_dir):
+        return []
+    first, last = start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+    paths = []
+    for day in sorted(os.listdir(archive_dir)):
+        if first <= day <= last:
+            partition = os.path.join(archive_dir, day)
+            paths += [os.path.join(partition, name) for name in sorted(os.listdir(partition)) if name.endswith('.npz')]
+    return paths
+
+
+# Archived readings in [start, end) as column arrays, optionally for one device only.
+# The result has the same keys as ARCHIVE_COLUMNS and is sorted by timestamp.
+def read_columns(archive_dir, start=datetime(1970, 1, 1), end=datetime(9999, 1, 1), device=None):
+    start_seconds = (start - datetime(1970, 1, 1)).total_seconds()
+    end_seconds = (end - datetime(1970, 1, 1)).total_seconds()
+
+    parts = []
+    for path in _partition_paths(archive_dir, start, end):
+        with np.load(path) as part:
+            mask = (part['timestamp'] >= start_seconds) & (part['timestamp'] < end_seconds)
+            if device is not None:
+                mask &= part['device_id'] == device
+            if mask.any():
+                # Parts archived before anomaly detection have no flags, read as none raised
+                parts.append({name: part[name][mask] if name in part.files else np.zeros(mask.sum(), dtype=np.uint32)
+                              for name in ARCHIVE_COLUMNS})
+
+    if not parts:
+        return {name: np.empty(0, dtype=np.float64) for name in ARCHIVE_COLUMNS}
+
+    columns = {name: np.concatenate([part[name] for part in parts]) for name in ARCHIVE_COLUMNS}
+    order = np.argsort(columns['timestamp'], kind='stable')
+    return {name: values[order] for name, values in columns.items()}
+
@@ -0,0 +1,161 @@
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import anomaly
+from history import SENSOR_COLUMNS
+
+# Checks that the anomaly detector flags injected faults and stays quiet on
+# clean noise, followed by its cost per reading, which has to stay within
+# the budget of the ingest path.
+#   python bench_anomaly.py --readings 200000 --devices 50
+#   python bench_anomaly.py --check-only
+
+BUDGET_MICROSECONDS = 50
+
+# Typical level and noise of each sensor on a board
+BASELINE = {
+    'temperature': (22.0, 0.1),
+    'humidity': (45.0, 0.5),
+    'pressure': (101.3, 0.005),
+    'light': (300.0, 5.0),
+    'tvoc': (0.05, 0.002),
+    'smoke': (120.0, 1.0),
+}
+
+
+def make_row(device, timestamp, rng):
+    row = {'device_id': device, 'timestamp': timestamp}
+    for name in SENSOR_COLUMNS:
+        level, noise = BASELINE[name]
+        row[name] = round(rng.gauss(level, noise), 3)
+    return row
+
+
+def clean_series(count, rng, device='check', interval=2.0):
+    start = datetime(2026, 1, 1)
+    return [make_row(device, start + timedelta(seconds=index * interval), rng) for index in range(count)]
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def flagged(rows, sensor, kind):
+    bit = anomaly.flag(sensor, kind)
+    return [index for index, row in enumerate(rows) if row['anomaly_flags'] & bit]
+
+
+def check_detector():
+    rng = random.Random(1)
+
+    # Clean noise: hardly anything flagged
+    rows = anomaly.AnomalyDetector().process(clean_series(5000, rng))
+    false_alarms = sum(1 for row in rows if row['anomaly_flags'])
+    check(false_alarms <= 5, f"{false_alarms} of 5000 clean readings flagged")
+
+    # A smoke spike is an outlier and a jump, the readings around it are not
+    rows = clean_series(600, rng)
+    rows[400]['smoke'] += 40
+    anomaly.AnomalyDetector().process(rows)
+    check(flagged(rows, 'smoke', anomaly.OUTLIER) == [400], "smoke spike flagged as outlier")
+    check(400 in flagged(rows, 'smoke', anomaly.RATE), "smoke spike flagged as rate violation")
+
+    # A frozen TVOC sensor repeats its last value
+    rows = clean_series(900, rng)
+    for row in rows[400:]:
+        row['tvoc'] = rows[399]['tvoc']
+    anomaly.AnomalyDetector().process(rows)
+    stuck = flagged(rows, 'tvoc', anomaly.FLATLINE)
+    check(stuck and stuck[0] == 399 + anomaly.LIMITS['tvoc'].flatline, "frozen tvoc flagged as flatline")
+
+    # Temperature creeping up by 3 °C over half an hour
+    rows = clean_series(2000, rng)
+    for index, row in enumerate(rows[1000:1900]):
+        row['temperature'] += 3.0 * index / 900
+    for row in rows[1900:]:
+        row['temperature'] += 3.0
+    anomaly.AnomalyDetector().process(rows)
+    check(flagged(rows, 'temperature', anomaly.DRIFT), "temperature drift flagged")
+    check(not flagged(rows[:1000], 'temperature', anomaly.DRIFT), "no drift before it starts")
+
+    # A batch sent newest first is flagged as if it had been streamed in time order
+    rows = clean_series(600, rng)
+    rows[400]['smoke'] += 40
+    streamed = [dict(row) for row in rows]
+    detector = anomaly.AnomalyDetector()
+    for row in streamed:
+        detector.process([row])
+    batched = [dict(row) for row in rows]
+    anomaly.AnomalyDetector().process(batched[::-1])
+    check([row['anomaly_flags'] for row in batched] == [row['anomaly_flags'] for row in streamed],
+          "out-of-order batch flagged like the same readings streamed")
+
+    # Bits round-trip through describe(), and older readings are left alone
+    flags = anomaly.flag('tvoc', anomaly.FLATLINE) | anomaly.flag('smoke', anomaly.OUTLIER)
+    check(anomaly.describe(flags) == {'tvoc': ['flatline'], 'smoke': ['outlier']}, "describe() of a bitmask")
+    detector = anomaly.AnomalyDetector()
+    rows = clean_series(100, rng)
+    detector.process(rows[50:])
+    late = dict(rows[0], smoke=1000.0)
+    detector.process([late])
+    check(late['anomaly_flags'] == 0, "reading older than the newest one left unflagged")
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1e6
+
+
+def benchmark(args):
+    rng = random.Random(2)
+    devices = ['AA:BB:CC:00:%02X:%02X' % (number >> 8, number & 0xFF) for number in range(args.devices)]
+    start = datetime(2026, 1, 1)
+    rows = [make_row(devices[index % args.devices], start + timedelta(seconds=index // args.devices * args.interval), rng)
+            for index in range(args.readings)]
+
+    # Batches, as /receive_batch and the ingest writer hand them over
+    detector = anomaly.AnomalyDetector()
+    started = time.perf_counter()
+    for offset in range(0, len(rows), args.batch_size):
+        detector.process(rows[offset:offset + args.batch_size])
+    batch = (time.perf_counter() - started) / len(rows) * 1e6
+
+    # One reading per call, as /receive_data does, on series that are already warm
+    single = []
+    for row in rows[:args.single]:
+        row = dict(row, timestamp=row['timestamp'] + timedelta(days=1))
+        started = time.perf_counter()
+        detector.process([row])
+        single.append(time.perf_counter() - started)
+
+    print(f"batches of {args.batch_size}: {batch:6.2f} µs/reading | single readings: "
+          f"p50 {percentile(single, 50):6.2f} µs, p99 {percentile(single, 99):6.2f} µs | "
+          f"budget {BUDGET_MICROSECONDS} µs")
+    return batch <= BUDGET_MICROSECONDS and percentile(single, 50) <= BUDGET_MICROSECONDS
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and benchmark the streaming anomaly detector.')
+    parser.add_argument('--readings', type=int, default=100000)
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=2.0, help='Seconds between readings of one board')
+    parser.add_argument('--batch-size', type=int, default=500, help='Readings per process() call')
+    parser.add_argument('--single', type=int, default=10000, help='Readings timed one call each')
+    parser.add_argument('--check-only', action='store_true', help='Only run the detection checks')
+    args = parser.parse_args()
+
+    check_detector()
+    print("detection checks passed")
+    if not args.check_only and not benchmark(args):
+        print(f"over the budget of {BUDGET_MICROSECONDS} µs per reading")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,298 @@
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import ingest
+
+# Benchmark of a running server with a simulated fleet of SensorDuino boards.
+# Every board drifts its readings slowly and now and then has an alarm
+# excursion. Modes:
+#   single  one JSON reading per request, a new connection each time (the old firmware)
+#   batch   packed binary records to /receive_batch every --batch-every readings (the current firmware)
+#   socket  one JSON reading per request over a persistent keep-alive connection
+# Measured: accepted readings/s and request latency, reading -> SocketIO
+# delivery latency, /get_latest_data and /history latency while under load,
+# and how much the storage grew. The result is printed as JSON.
+#   python bench_fleet.py --mode batch --boards 200 --interval 0.05 --duration 30 --output batch.json
+
+# Excursions that trip the default alarm rules: (firmware field, value)
+EXCURSIONS = [('temperature', 35.0), ('temperature', 5.0), ('humidity', 30.0), ('pressure', 95.0),
+              ('CH2O', 0.2), ('gas', 50.0)]
+
+
+def device_name(number):
+    # Fake but well-formed MAC address per simulated board
+    return 'AA:BB:CC:%02X:%02X:%02X' % ((number >> 16) & 0xFF, (number >> 8) & 0xFF, number & 0xFF)
+
+
+# One board's sensors: slow mean-reverting random walks plus alarm excursions
+class Sensors:
+    def __init__(self, rng, excursion_rate):
+        self.rng = rng
+        self.excursion_rate = excursion_rate
+        self.values = {'temperature': rng.uniform(19, 25), 'humidity': rng.uniform(45, 55),
+                       'pressure': rng.uniform(100.5, 102), 'light': rng.uniform(50, 400),
+                       'CH2O': rng.uniform(0.02, 0.06), 'gas': rng.uniform(10, 25)}
+        self.centres = dict(self.values)
+        self.excursion = None  # (field, value, readings left)
+
+    def read(self):
+        for field, centre in self.centres.items():
+            step = self.rng.gauss(0, 0.002 * max(abs(centre), 1))
+            self.values[field] += 0.05 * (centre - self.values[field]) + step
+        reading = {field: round(value, 3) for field, value in self.values.items()}
+
+        if self.excursion is None and self.rng.random() < self.excursion_rate:
+            field, value = self.rng.choice(EXCURSIONS)
+            self.excursion = (field, value, self.rng.randint(5, 30))
+        if self.excursion is not None:
+            field, value, left = self.excursion
+            reading[field] = value
+            self.excursion = (field, value, left - 1) if left > 1 else None
+        return reading
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_latencies = []
+        self.statuses = {}
+        self.sent = 0
+        self.accepted = 0
+        self.sent_at = {}  # (device, sequence) -> send time, for tracked boards
+        self.delivery_latencies = []
+        self.latest_latencies = []
+        self.history_latencies = []
+
+    def request(self, elapsed, status, readings, accepted):
+        with self.lock:
+            self.request_latencies.append(elapsed)
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+            self.sent += readings
+            self.accepted += accepted
+
+
+def post(connection, path, body, headers):
+    connection.request('POST', path, body, headers)
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+def board(number, args, deadline, results, tracked):
+    rng = random.Random(number)
+    sensors = Sensors(rng, args.excursion_rate)
+    device = device_name(number)
+    target = urlsplit(args.ingest_url)
+    connection = None
+    pending = []
+    taken = []  # time.monotonic() when each pending reading was taken
+    sequence = 0
+
+    while time.time() < deadline:
+        started = time.perf_counter()
+        reading = sensors.read()
+        if tracked:
+            # Tracked boards carry a sequence number in the light channel so
+            # SocketIO deliveries can be matched to the reading that caused them
+            sequence += 1
+            reading['light'] = float(sequence)
+        pending.append(reading)
+        taken.append(time.monotonic())
+
+        if args.mode != 'batch' or len(pending) >= args.batch_every:
+            if args.mode == 'batch':
+                # Like the firmware without a clock: each record carries its age in ms, so the
+                # server dates every reading when it was taken rather than when it was uploaded
+                now = time.monotonic()
+                body = b''.join(ingest.BATCH_RECORD.pack(*(record[field] for field in ingest.BATCH_RECORD_FIELDS),
+                                                         int((now - at) * 1000))
+                                for record, at in zip(pending, taken))
+                path, headers = '/receive_batch', {'Content-Type': 'application/octet-stream', 'X-Device-ID': device}
+            else:
+                body = json.dumps(dict(pending[0], device=device))
+                path, headers = '/receive_data', {'Content-Type': 'application/json'}
+
+            if tracked:
+                with results.lock:
+                    results.sent_at[(device, float(sequence))] = time.time()
+            sent_at = time.perf_counter()
+            try:
+                if connection is None:
+                    connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=10)
+                status, response = post(connection, path, body, headers)
+                if args.mode == 'batch':
+                    accepted = json.loads(response).get('accepted', 0) if status == 200 else 0
+                else:
+                    accepted = 1 if status == 200 else 0
+            except (OSError, http.client.HTTPException, ValueError):
+                status, accepted = 'error', 0
+                connection.close()
+                connection = None
+            results.request(time.perf_counter() - sent_at, status, len(pending), accepted)
+            pending = []
+            taken = []
+            if args.mode == 'single' and connection is not None:
+                connection.close()
+                connection = None
+
+        if args.interval:
+            time.sleep(max(0.0, args.interval - (time.perf_counter() - started)))
+
+    if connection is not None:
+        connection.close()
+
+
+def listen(device, args, results, stop):
+    import socketio
+
+    client = socketio.Client()
+
+    @client.on('sensor_data')
+    def on_sensor_data(payload):
+        received = time.time()
+        with results.lock:
+            sent = results.sent_at.pop((payload['device'], payload['light']), None)
+            if sent is not None:
+                results.delivery_latencies.append(received - sent)
+
+    client.connect(args.app_url)
+    client.emit('subscribe', {'device': device})
+    stop.wait()
+    client.disconnect()
+
+
+def query(args, results, deadline, devices):
+    target = urlsplit(args.app_url)
+    connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+    while time.time() < deadline:
+        device = random.choice(devices)
+        for path, latencies in ((f'/get_latest_data?device={device}', results.latest_latencies),
+                                (f'/history?device={device}&from={time.time() - 3600:.0f}&max_points=500',
+                                 results.history_latencies)):
+            started = time.perf_counter()
+            try:
+                connection.request('GET', path)
+                connection.getresponse().read()
+                latencies.append(time.perf_counter() - started)
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+        time.sleep(args.query_interval)
+
+
+def storage_bytes(paths):
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            total += sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+        elif os.path.exists(path):
+            total += os.path.getsize(path)
+    return total
+
+
+def summary(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def at(pct):
+        return round(values[min(len(values) - 1, int(math.ceil(pct / 100 * len(values))) - 1)] * 1000, 3)
+
+    return {'count': len(values), 'p50': at(50), 'p95': at(95), 'p99': at(99), 'max': round(values[-1] * 1000, 3)}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark a running server with a simulated sensor fleet.')
+    parser.add_argument('--mode', choices=('single', 'batch', 'socket'), default='single')
+    parser.add_argument('--boards', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds of load')
+    parser.add_argument('--interval', type=float, default=2.0, help='Seconds between readings of one board')
+    parser.add_argument('--batch-every', type=int, default=30, help='Readings per upload in batch mode')
+    parser.add_argument('--excursion-rate', type=float, default=0.002, help='Chance per reading an alarm excursion starts')
+    parser.add_argument('--ingest-url', default='http://127.0.0.1:8080', help='Where boards post readings')
+    parser.add_argument('--app-url', default='http://127.0.0.1:5000', help='Dashboard server (SocketIO and queries)')
+    parser.add_argument('--track', type=int, default=5, help='Boards whose readings are followed over SocketIO')
+    parser.add_argument('--query-interval', type=float, default=0.5, help='Seconds between dashboard queries')
+    parser.add_argument('--storage-path', action='append',
+                        help='File or directory whose growth is measured (repeatable), default the instance database')
+    parser.add_argument('--settle', type=float, default=3.0,
+                        help='Seconds to wait after the load for queued writes and SocketIO frames')
+    parser.add_argument('--output', help='Write the JSON result here as well')
+    args = parser.parse_args()
+
+    storage_paths = args.storage_path or ['instance/sensor_data.db', 'instance/sensor_data.db-wal', 'instance/columns']
+    devices = [device_name(number) for number in range(args.boards)]
+    tracked = set(range(min(args.track, args.boards)))
+    results = Results()
+
+    stop_listening = threading.Event()
+    listeners = [threading.Thread(target=listen, args=(devices[number], args, results, stop_listening), daemon=True)
+                 for number in tracked]
+    for listener in listeners:
+        listener.start()
+    time.sleep(1.0 if listeners else 0)
+
+    size_before = storage_bytes(storage_paths)
+    started_at = datetime.utcnow()
+    deadline = time.time() + args.duration
+    threads = [threading.Thread(target=board, args=(number, args, deadline, results, number in tracked))
+               for number in range(args.boards)]
+    threads.append(threading.Thread(target=query, args=(args, results, deadline, devices)))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    time.sleep(args.settle)
+    stop_listening.set()
+    size_after = storage_bytes(storage_paths)
+
+    result = {
+        'revision': git_revision(),
+        'started_at': started_at.isoformat(timespec='seconds') + 'Z',
+        'mode': args.mode,
+        'boards': args.boards,
+        'interval': args.interval,
+        'batch_every': args.batch_every if args.mode == 'batch' else 1,
+        'duration': round(wall, 3),
+        'readings_sent': results.sent,
+        'readings_accepted': results.accepted,
+        'readings_per_second': round(results.accepted / wall, 1),
+        'requests_per_second': round(len(results.request_latencies) / wall, 1),
+        'status_codes': results.statuses,
+        'request_latency_ms': summary(results.request_latencies),
+        'socketio_delivery_ms': summary(results.delivery_latencies),
+        'get_latest_data_ms': summary(results.latest_latencies),
+        'history_ms': summary(results.history_latencies),
+        'storage_growth_bytes': size_after - size_before,
+        'storage_bytes_per_reading': round((size_after - size_before) / results.accepted, 1) if results.accepted else None
+    }
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    return 0 if results.accepted else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+import history
+import rollups
+import storage
+from models import db, SensorData
+
+# Compares the old SQLite setup (rollback journal, default pragmas, one engine
+# for everything) with the tuned one from storage.py (WAL, pragmas, a single
+# writer connection, read-only reader pool, checkpointer).
+# The ingest writer inserts batches like the write-behind queue does, while
+# reader processes run dashboard history queries and training-style scans.
+#   python bench_sqlite.py --rows 200000 --readers 4 --duration 20
+
+
+def make_rows(count, devices, start):
+    rows = []
+    for index in range(count):
+        rows.append({
+            'device_id': devices[index % len(devices)],
+            'temperature': random.uniform(18, 32), 'humidity': random.uniform(35, 60),
+            'pressure': random.uniform(99, 102), 'light': random.uniform(0, 500),
+            'tvoc': random.uniform(0.01, 0.12), 'smoke': random.uniform(10, 40),
+            'temp_alarm': 0, 'humidity_alarm': 0, 'pressure_alarm': 0,
+            'light_alarm': 0, 'tvoc_alarm': 0, 'smoke_alarm': 0,
+            'timestamp': start + timedelta(seconds=index * 2 / len(devices))
+        })
+    return rows
+
+
+def engines(url, mode, readers=1):
+    if mode == 'tuned':
+        return storage.create_writer_engine(url), storage.create_reader_engine(url, readers)
+    engine = create_engine(url)
+    return engine, engine
+
+
+def populate(url, count, devices):
+    engine = create_engine(url)
+    db.metadata.create_all(engine)
+    start = datetime.utcnow() - timedelta(seconds=count * 2 / len(devices))
+    for offset in range(0, count, 50000):
+        rows = make_rows(min(50000, count - offset), devices, start + timedelta(seconds=offset * 2 / len(devices)))
+        with engine.begin() as connection:
+            connection.execute(SensorData.__table__.insert(), rows)
+            rollups.apply(connection, rows)
+    engine.dispose()
+
+
+def reader(url, mode, devices, deadline, results):
+    _, engine = engines(url, mode)
+    latencies, errors = [], 0
+    while time.time() < deadline:
+        end = datetime.utcnow()
+        started = time.perf_counter()
+        try:
+            connection = engine.raw_connection()
+            try:
+                # Mostly dashboard history windows, every tenth query a whole-table scan like training does
+                if random.random() < 0.1:
+                    cursor = connection.cursor()
+                    cursor.execute('SELECT * FROM sensor_data')
+                    while cursor.fetchmany(10000):
+                        pass
+                    cursor.close()
+                else:
+                    history.fetch_columns(connection, random.choice(devices), end - timedelta(hours=1), end)
+            finally:
+                connection.close()
+            latencies.append(time.perf_counter() - started)
+        # Raw connections raise the sqlite3 error itself
+        except (OperationalError, sqlite3.OperationalError):
+            errors += 1
+    results.put((latencies, errors))
+
+
+def writer(engine, devices, deadline, batch_size, latencies, errors):
+    while time.time() < deadline:
+        rows = make_rows(batch_size, devices, datetime.utcnow())
+        started = time.perf_counter()
+        try:
+            with engine.begin() as connection:
+                connection.execute(SensorData.__table__.insert(), rows)
+                rollups.apply(connection, rows)
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            errors.append(1)
+
+
+def percentile(values, q):
+    return np.percentile(values, q) * 1000 if values else float('nan')
+
+
+def run(mode, args, devices):
+    directory = tempfile.mkdtemp(prefix='bench-sqlite-')
+    url = f'sqlite:///{os.path.join(directory, "sensor_data.db")}'
+    populate(url, args.rows, devices)
+
+    write_engine, _ = engines(url, mode, args.readers)
+    checkpointer = storage.Checkpointer(write_engine, interval=5.0) if mode == 'tuned' else None
+    if checkpointer:
+        checkpointer.start()
+
+    deadline = time.time() + args.duration
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=reader, args=(url, mode, devices, deadline, results))
+                 for _ in range(args.readers)]
+    for process in processes:
+        process.start()
+
+    write_latencies, write_errors = [], []
+    thread = threading.Thread(target=writer, args=(write_engine, devices, deadline, args.batch_size,
+                                                   write_latencies, write_errors))
+    thread.start()
+    thread.join()
+
+    read_latencies, read_errors = [], 0
+    for _ in processes:
+        latencies, errors = results.get()
+        read_latencies += latencies
+        read_errors += errors
+    for process in processes:
+        process.join()
+    if checkpointer:
+        checkpointer.stop()
+
+    print(f"{mode:>8}: writes {len(write_latencies) * args.batch_size / args.duration:9.0f} rows/s, "
+          f"batch p50 {percentile(write_latencies, 50):7.1f} ms p99 {percentile(write_latencies, 99):7.1f} ms "
+          f"max {percentile(write_latencies, 100):7.1f} ms, {len(write_errors)} locked | "
+          f"reads {len(read_latencies) / args.duration:7.1f} q/s, "
+          f"p50 {percentile(read_latencies, 50):7.1f} ms p99 {percentile(read_latencies, 99):7.1f} ms, "
+          f"{read_errors} locked")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the SQLite setups under concurrent ingest and reads.')
+    parser.add_argument('--rows', type=int, default=200000, help='Readings in the database before the run')
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--readers', type=int, default=4, help='Reader processes')
+    parser.add_argument('--batch-size', type=int, default=500, help='Rows per write transaction')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds per setup')
+    parser.add_argument('--mode', choices=('default', 'tuned', 'both'), default='both')
+    args = parser.parse_args()
+
+    devices = ['AA:BB:CC:00:00:%02X' % number for number in range(args.devices)]
+    for mode in (('default', 'tuned') if args.mode == 'both' else (args.mode,)):
+        run(mode, args, devices)
+
+
+if __name__ == '__main__':
+    main()
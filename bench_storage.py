@@ -0,0 +1,192 @@
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine
+
+from column_store import ColumnFileStore
+from history import SENSOR_COLUMNS
+from models import db
+from rollups import ALARM_COLUMNS
+from store import SQLiteStore
+
+# Conformance checks every storage backend has to pass, followed by an
+# ingest / query benchmark of the backends side by side.
+#   python bench_storage.py --rows 500000 --devices 50
+#   python bench_storage.py --check-only
+
+
+def open_sqlite(directory):
+    url = f'sqlite:///{os.path.join(directory, "sensor_data.db")}'
+    engine = create_engine(url)
+    db.metadata.create_all(engine)
+    engine.dispose()
+    return SQLiteStore(url)
+
+
+def open_columns(directory):
+    return ColumnFileStore(os.path.join(directory, 'columns'))
+
+
+BACKENDS = {'sqlite': open_sqlite, 'columns': open_columns}
+
+
+def make_row(device, timestamp):
+    row = {'device_id': device, 'timestamp': timestamp}
+    for name in SENSOR_COLUMNS:
+        row[name] = round(random.uniform(0, 100), 3)
+    for name in ALARM_COLUMNS:
+        row[name] = random.randint(0, 1)
+    row['anomaly_flags'] = 0
+    return row
+
+
+def disk_usage(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def check_columns(columns, rows, message):
+    rows = sorted(rows, key=lambda row: row['timestamp'])
+    check(len(columns['timestamp']) == len(rows), f"{message}: {len(columns['timestamp'])} rows, expected {len(rows)}")
+    expected = np.array([(row['timestamp'] - datetime(1970, 1, 1)).total_seconds() for row in rows])
+    check(np.allclose(columns['timestamp'], expected, rtol=0, atol=1e-3), f"{message}: timestamps differ")
+    for name in SENSOR_COLUMNS:
+        check(np.allclose(columns[name], [row[name] for row in rows]), f"{message}: {name} differs")
+
+
+# The behaviour app.py relies on, run against a fresh store from `open_store(directory)`
+def check_backend(open_store):
+    directory = tempfile.mkdtemp(prefix='store-check-')
+    try:
+        store = open_store(directory)
+        start = datetime(2026, 1, 1, 12, 0, 0)
+        end = start + timedelta(hours=1)
+
+        check(store.latest() == [] and store.latest('a') == [], "empty store has no latest rows")
+        check(len(store.range_columns('a', start, end)['timestamp']) == 0, "empty store has no readings")
+        check(len(store.rollup_columns('a', 60, start, end)['timestamp']) == 0, "empty store has no rollups")
+
+        # Two devices, two batches, readings every 7.5 s over ~3 minutes
+        rows = [make_row(device, start + timedelta(seconds=7.5 * index, microseconds=index))
+                for index in range(24) for device in ('a', 'b')]
+        store.append(rows[:20])
+        store.append(rows[20:])
+        # A late retry, older than what the device already has
+        late = make_row('a', start + timedelta(seconds=31))
+        store.append([late])
+        rows_a = [row for row in rows if row['device_id'] == 'a'] + [late]
+
+        newest = max(rows_a, key=lambda row: row['timestamp'])
+        latest = store.latest('a')
+        check(len(latest) == 1 and latest[0]['timestamp'] == newest['timestamp'], "latest('a') is the newest reading")
+        for name in SENSOR_COLUMNS + ALARM_COLUMNS + ('device_id',):
+            check(latest[0][name] == newest[name], f"latest('a') keeps {name}")
+        check(store.latest()[0]['device_id'] == 'a', "latest() is the device written last")
+        recent = store.latest('b', 3)
+        check([row['timestamp'] for row in recent] ==
+              sorted((row['timestamp'] for row in rows if row['device_id'] == 'b'), reverse=True)[:3],
+              "latest('b', 3) is newest first")
+
+        check_columns(store.range_columns('a', start, end), rows_a, "full range of 'a'")
+        # [from, to) includes the reading at `from` and excludes the one at `to`
+        window = (rows_a[4]['timestamp'], rows_a[10]['timestamp'])
+        check_columns(store.range_columns('a', *window),
+                      [row for row in rows_a if window[0] <= row['timestamp'] < window[1]], "window of 'a'")
+        check(len(store.range_columns('c', start, end)['timestamp']) == 0, "unknown device has no readings")
+
+        rollup = store.rollup_columns('a', 60, start, end)
+        buckets = {}
+        for row in rows_a:
+            buckets.setdefault(int((row['timestamp'] - start).total_seconds() // 60), []).append(row)
+        check(list(rollup['count']) == [len(buckets[key]) for key in sorted(buckets)], "rollup counts per minute")
+        for position, key in enumerate(sorted(buckets)):
+            check(abs(rollup['timestamp'][position] - ((start - datetime(1970, 1, 1)).total_seconds() + key * 60 + 30)) < 1e-3,
+                  "rollup time is the bucket midpoint")
+            for name in SENSOR_COLUMNS:
+                values = [row[name] for row in buckets[key]]
+                check(np.isclose(rollup[name][position], np.mean(values)), f"rollup mean of {name}")
+                check(np.isclose(rollup[f'{name}_min'][position], min(values)), f"rollup min of {name}")
+                check(np.isclose(rollup[f'{name}_max'][position], max(values)), f"rollup max of {name}")
+
+        # Everything survives reopening the store
+        store.close()
+        store = open_store(directory)
+        check_columns(store.range_columns('a', start, end), rows_a, "range of 'a' after reopening")
+        check(store.latest('a')[0]['timestamp'] == newest['timestamp'], "latest('a') after reopening")
+        store.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)) * 1000, 3)
+
+
+def benchmark(name, open_store, args):
+    directory = tempfile.mkdtemp(prefix=f'store-bench-{name}-')
+    try:
+        store = open_store(directory)
+        devices = ['AA:BB:CC:00:%02X:%02X' % (number >> 8, number & 0xFF) for number in range(args.devices)]
+        end = datetime.utcnow()
+        start = end - timedelta(seconds=args.rows * args.interval / args.devices)
+
+        started = time.perf_counter()
+        for offset in range(0, args.rows, args.batch_size):
+            store.append([make_row(devices[index % args.devices],
+                                   start + timedelta(seconds=index // args.devices * args.interval))
+                          for index in range(offset, min(offset + args.batch_size, args.rows))])
+        ingest_seconds = time.perf_counter() - started
+
+        latest, window, rollup = [], [], []
+        for _ in range(args.queries):
+            device = random.choice(devices)
+            started = time.perf_counter()
+            store.latest(device)
+            latest.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            store.range_columns(device, end - timedelta(hours=1), end)
+            window.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            store.rollup_columns(device, 60, start, end)
+            rollup.append(time.perf_counter() - started)
+        store.close()
+
+        print(f"{name:>8}: ingest {args.rows / ingest_seconds:9.0f} rows/s | "
+              f"latest p50 {percentile(latest, 50):7.3f} ms | 1 h range p50 {percentile(window, 50):7.3f} ms | "
+              f"1 min rollup of all p50 {percentile(rollup, 50):7.3f} ms | disk {disk_usage(directory) / 1e6:7.1f} MB")
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and benchmark the storage backends.')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), action='append', help='Default: all')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=2.0, help='Seconds between readings of one board')
+    parser.add_argument('--batch-size', type=int, default=500, help='Rows per append, as the ingest queue writes')
+    parser.add_argument('--queries', type=int, default=50, help='Queries of each kind')
+    parser.add_argument('--check-only', action='store_true', help='Only run the conformance checks')
+    args = parser.parse_args()
+
+    for name in args.backend or sorted(BACKENDS):
+        check_backend(BACKENDS[name])
+        print(f"{name:>8}: conformance checks passed")
+        if not args.check_only:
+            benchmark(name, BACKENDS[name], args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import logging
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Room a dashboard joins to follow one board
+def device_room(device_id):
+    return f'device:{device_id}'
+
+
+# Coalesces live readings before they go out over SocketIO.
+# publish() only remembers the newest payload per device; every `interval`
+# seconds the pending payloads are emitted, one frame per device room, so a
+# burst of readings (e.g. a batch upload) costs each viewer at most one frame
+# per interval no matter how many readings arrived.
+class CoalescingBroadcaster:
+    def __init__(self, emit, interval=1.0, event='sensor_data'):
+        self.emit = emit  # emit(event, payload, room)
+        self.interval = interval
+        self.event = event
+
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def publish(self, payload):
+        with self._lock:
+            self._pending[payload['device']] = payload
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='socketio-broadcaster', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval * 2)
+            self._thread = None
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for device_id, payload in pending.items():
+            started = time.perf_counter()
+            try:
+                self.emit(self.event, payload, device_room(device_id))
+            except Exception as emit_error:
+                logger.warning("Failed to emit data via WebSocket: %s", emit_error)
+            metrics.EMIT_SECONDS.observe(time.perf_counter() - started, (self.event,))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+        self.flush()
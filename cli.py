@@ -0,0 +1,149 @@
+import argparse
+import logging
+import os
+import sys
+
+# One entry point for the server's roles; every mode imports only what it needs,
+# so a box that only receives data never loads Flask, SocketIO or scikit-learn.
+#   python cli.py web                         dashboard + SocketIO + sensor port 8080 (what app.py runs)
+#   python cli.py web --external-ingest       dashboard only, readings come from `ingest` processes
+#   python cli.py ingest --workers 4          headless sensor server on port 8080, see ingest_workers.py;
+#                                             the writer's /metrics is on port 9100 (--metrics-port)
+#   python cli.py predict --incremental       train the forecast model, options as Predict.py
+#   python cli.py migrate                     bring the database schema up to date (flask db upgrade)
+#   python cli.py broker                      local stand-in for Redis as the SocketIO message queue
+# Several web workers and the ingest writer share live updates through a message queue:
+#   python cli.py broker --port 6379
+#   python cli.py ingest --message-queue redis://127.0.0.1:6379/0
+#   python cli.py web --external-ingest --port 5001 --message-queue redis://127.0.0.1:6379/0
+#   python cli.py web --external-ingest --port 5002 --message-queue redis://127.0.0.1:6379/0
+# (behind a load balancer with sticky sessions, as Socket.IO long-polling needs)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+INSTANCE = os.path.join(HERE, 'instance')
+
+
+def web(args):
+    if args.message_queue:
+        # Read by app.py when it creates the SocketIO server
+        os.environ['SOCKETIO_MESSAGE_QUEUE'] = args.message_queue
+    import app as server
+
+    server.app.config['EXTERNAL_INGEST'] = args.external_ingest
+    sensor_port = None if args.external_ingest else args.sensor_port
+    server.run(host=args.host, port=args.port, sensor_port=sensor_port, debug=args.debug)
+
+
+def ingest(args):
+    import ingest_workers
+
+    def open_store():
+        import store
+
+        return store.open_store(args.backend, database_url=f'sqlite:///{os.path.abspath(args.database)}',
+                                directory=args.column_dir)
+
+    ingest_workers.run(open_store, rules_path=args.alarm_rules, host=args.host, port=args.port, workers=args.workers,
+                       queue_size=args.queue_size, batch_size=args.batch_size, flush_interval=args.flush_interval,
+                       message_queue=args.message_queue, metrics_port=args.metrics_port,
+                       models_dir=args.models_dir or None)
+
+
+def predict(args):
+    import Predict
+
+    Predict.main(args.options)
+
+
+def broker(args):
+    import message_broker
+
+    message_broker.serve(args.host, args.port)
+
+
+def migrate(args):
+    # A bare Flask app for Alembic: app.py would also open the store and start the server's threads
+    from flask import Flask
+    import flask_migrate
+
+    from models import DATABASE_URI, db
+
+    app = Flask(__name__, root_path=HERE, instance_path=INSTANCE)
+    app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+    db.init_app(app)
+    directory = os.path.join(HERE, 'migrations')
+    flask_migrate.Migrate(app, db, directory=directory, render_as_batch=True)
+    with app.app_context():
+        if args.command == 'upgrade':
+            flask_migrate.upgrade(directory, args.revision or 'head')
+        elif args.command == 'downgrade':
+            flask_migrate.downgrade(directory, args.revision or '-1')
+        else:
+            flask_migrate.current(directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run one role of the SensorDuino server.')
+    modes = parser.add_subparsers(dest='mode', required=True)
+
+    parser_web = modes.add_parser('web', help='Dashboard, SocketIO and (by default) the sensor server')
+    parser_web.add_argument('--host', default='0.0.0.0')
+    parser_web.add_argument('--port', type=int, default=5000)
+    parser_web.add_argument('--sensor-port', type=int, default=8080, help='0 to not open the sensor port')
+    parser_web.add_argument('--external-ingest', action='store_true',
+                            help='Readings are written by `ingest` processes; implies no sensor port')
+    parser_web.add_argument('--message-queue', help='Redis URL shared with other web and ingest processes')
+    parser_web.add_argument('--debug', action='store_true', help='Flask debugger and reloader')
+    parser_web.set_defaults(run=web)
+
+    parser_ingest = modes.add_parser('ingest', help='Headless sensor server with several worker processes')
+    parser_ingest.add_argument('--host', default='')
+    parser_ingest.add_argument('--port', type=int, default=8080)
+    parser_ingest.add_argument('--workers', type=int, default=None, help='Worker processes, default one per CPU')
+    parser_ingest.add_argument('--backend', choices=('sqlite', 'columns'), default='sqlite',
+                               help="Storage backend, as app.config['STORAGE_BACKEND']")
+    parser_ingest.add_argument('--database', default=os.path.join(INSTANCE, 'sensor_data.db'),
+                               help='SQLite database file, created by `migrate`')
+    parser_ingest.add_argument('--column-dir', default=os.path.join(INSTANCE, 'columns'))
+    parser_ingest.add_argument('--alarm-rules', default=os.path.join(HERE, 'alarm_rules.json'))
+    parser_ingest.add_argument('--queue-size', type=int, default=10000, help='Readings in flight before answering 503')
+    parser_ingest.add_argument('--batch-size', type=int, default=500, help='Rows per bulk insert')
+    parser_ingest.add_argument('--flush-interval', type=float, default=0.25,
+                               help='Seconds a reading may wait before being flushed')
+    parser_ingest.add_argument('--message-queue', help='Redis URL of the web workers, to push readings to dashboards')
+    parser_ingest.add_argument('--models-dir', default=os.path.join(INSTANCE, 'models'),
+                               help="Forecast models, as app.config['FORECAST_MODELS_DIR']; with --message-queue "
+                                    "the writer pushes predicted alarms. Empty to not forecast")
+    parser_ingest.add_argument('--metrics-port', type=int, default=9100,
+                               help="Port of the writer's Prometheus /metrics, 0 to not open it")
+    parser_ingest.set_defaults(run=ingest)
+
+    # Everything after `predict`, --help included, is handed to Predict.py
+    parser_predict = modes.add_parser('predict', help='Train the forecast model (options of Predict.py)',
+                                      add_help=False)
+    parser_predict.set_defaults(run=predict)
+
+    parser_broker = modes.add_parser('broker', help='Local stand-in for Redis pub/sub (SocketIO message queue)')
+    parser_broker.add_argument('--host', default='127.0.0.1')
+    parser_broker.add_argument('--port', type=int, default=6379)
+    parser_broker.set_defaults(run=broker)
+
+    parser_migrate = modes.add_parser('migrate', help='Upgrade (default), downgrade or show the database schema')
+    parser_migrate.add_argument('command', nargs='?', choices=('upgrade', 'downgrade', 'current'), default='upgrade')
+    parser_migrate.add_argument('revision', nargs='?', help='Target revision, default head (or one step down)')
+    parser_migrate.set_defaults(run=migrate)
+
+    args, options = parser.parse_known_args(argv)
+    args.options = options
+    if args.options and args.run is not predict:
+        parser.error(f"unrecognized arguments: {' '.join(args.options)}")
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    # Alembic announces every plugin it sets up at INFO as soon as Flask-Migrate is imported,
+    # so this has to come before any mode imports it; `migrate` gets its upgrade messages
+    # back from the logging section of migrations/alembic.ini
+    logging.getLogger('alembic').setLevel(logging.WARNING)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
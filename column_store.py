@@ -0,0 +1,186 @@
+import os
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from history import SENSOR_COLUMNS
+from rollups import ALARM_COLUMNS
+from store import SensorStore
+
+# Append-only column files, one directory per device:
+#   <directory>/<hex of device id>/timestamp.bin, temperature.bin, ..., smoke_alarm.bin, anomaly_flags.bin, count
+# Every column is a flat little-endian array; timestamps are int64 microseconds
+# since the epoch. A batch is appended to every column file first and only then
+# committed by rewriting `count`, so readers (and a restart after a crash)
+# never see half a batch. Reads memory-map the files and slice them with
+# searchsorted, rollups are computed from the raw columns on the fly.
+
+COLUMNS = (('timestamp', '<i8'),) + tuple((name, '<f8') for name in SENSOR_COLUMNS) \
+    + tuple((name, 'i1') for name in ALARM_COLUMNS) + (('anomaly_flags', '<u4'),)
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def _to_micros(timestamp):
+    return (timestamp - EPOCH) // MICROSECOND
+
+
+class DeviceColumns:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        count_path = os.path.join(path, 'count')
+        self.count = 0
+        if os.path.exists(count_path):
+            with open(count_path) as f:
+                self.count = int(f.read() or 0)
+
+        # Drop whatever an interrupted append left behind the committed rows
+        # (and zero-fill a column added since the directory was written)
+        for name, dtype in COLUMNS:
+            column_path = self._column_path(name)
+            size = self.count * np.dtype(dtype).itemsize
+            if not os.path.exists(column_path) or os.path.getsize(column_path) != size:
+                with open(column_path, 'ab') as f:
+                    f.truncate(size)
+
+        timestamps = self.column('timestamp')
+        # Readings appended out of time order switch range queries from searchsorted to a full scan
+        self.ordered = bool(np.all(timestamps[1:] >= timestamps[:-1]))
+        self.last_timestamp = int(timestamps[-1]) if self.count else None
+
+    def _column_path(self, name):
+        return os.path.join(self.path, f'{name}.bin')
+
+    # Memory-mapped view of the first `count` values (default: all committed ones)
+    def column(self, name, count=None):
+        count = self.count if count is None else count
+        dtype = dict(COLUMNS)[name]
+        if not count:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self._column_path(name), dtype=dtype, mode='r', shape=(count,))
+
+    def append(self, columns):
+        length = len(columns['timestamp'])
+        for name, dtype in COLUMNS:
+            with open(self._column_path(name), 'ab') as f:
+                f.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+
+        # Commit: rewrite the row count atomically
+        temporary = os.path.join(self.path, 'count.tmp')
+        with open(temporary, 'w') as f:
+            f.write(str(self.count + length))
+        os.replace(temporary, os.path.join(self.path, 'count'))
+
+        timestamps = columns['timestamp']
+        if self.ordered:
+            self.ordered = bool(np.all(timestamps[1:] >= timestamps[:-1])) and \
+                (self.last_timestamp is None or timestamps[0] >= self.last_timestamp)
+        newest = int(timestamps.max())
+        self.last_timestamp = newest if self.last_timestamp is None else max(newest, self.last_timestamp)
+        self.count += length
+
+    # Positions of the readings in [start, end) microseconds, in time order
+    def select(self, start, end, count):
+        timestamps = self.column('timestamp', count)
+        if self.ordered:
+            return np.arange(np.searchsorted(timestamps, start), np.searchsorted(timestamps, end))
+        positions = np.flatnonzero((timestamps >= start) & (timestamps < end))
+        return positions[np.argsort(timestamps[positions], kind='stable')]
+
+    def rows(self, positions, count):
+        columns = {name: np.array(self.column(name, count)[positions]) for name, _ in COLUMNS}
+        device_id = bytes.fromhex(os.path.basename(self.path)).decode()
+        result = []
+        for index in range(len(positions)):
+            row = {name: columns[name][index].item() for name, _ in COLUMNS}
+            row['timestamp'] = EPOCH + MICROSECOND * row['timestamp']
+            row['device_id'] = device_id
+            result.append(row)
+        return result
+
+
+class ColumnFileStore(SensorStore):
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._devices = {bytes.fromhex(name).decode(): DeviceColumns(os.path.join(directory, name))
+                         for name in sorted(os.listdir(directory))
+                         if os.path.isdir(os.path.join(directory, name))}
+        # Device of the newest reading, what latest() without a device returns
+        stored = [(columns.last_timestamp, device) for device, columns in self._devices.items() if columns.count]
+        self._last_device = max(stored)[1] if stored else None
+
+    def _device(self, device):
+        columns = self._devices.get(device)
+        if columns is None:
+            columns = self._devices[device] = DeviceColumns(os.path.join(self.directory, device.encode().hex()))
+        return columns
+
+    def append(self, rows):
+        if not rows:
+            return
+        by_device = {}
+        for row in rows:
+            by_device.setdefault(row['device_id'], []).append(row)
+
+        with self._lock:
+            for device, device_rows in by_device.items():
+                columns = {name: [row[name] for row in device_rows] for name, _ in COLUMNS if name != 'timestamp'}
+                columns['timestamp'] = np.array([_to_micros(row['timestamp']) for row in device_rows], dtype=np.int64)
+                self._device(device).append(columns)
+            self._last_device = rows[-1]['device_id']
+
+    def latest(self, device=None, limit=1):
+        device = device or self._last_device
+        columns = self._devices.get(device)
+        if columns is None:
+            return []
+        count = columns.count
+        if columns.ordered:
+            positions = np.arange(count - 1, max(count - limit, 0) - 1, -1)
+        else:
+            positions = np.argsort(columns.column('timestamp', count), kind='stable')[::-1][:limit]
+        return columns.rows(positions, count)
+
+    def range_columns(self, device, start, end):
+        columns = self._devices.get(device)
+        count = columns.count if columns is not None else 0
+        if not count:
+            return {name: np.empty(0) for name in ('timestamp',) + SENSOR_COLUMNS}
+
+        positions = columns.select(_to_micros(start), _to_micros(end), count)
+        result = {'timestamp': columns.column('timestamp', count)[positions] / 1e6}
+        for name in SENSOR_COLUMNS:
+            result[name] = np.array(columns.column(name, count)[positions], dtype=np.float64)
+        return result
+
+    # Same buckets as the sensor_rollup table: [start, end) aligned to the
+    # resolution, time is the bucket midpoint and the value the mean
+    def rollup_columns(self, device, resolution, start, end):
+        names = ['timestamp', 'count'] + [f'{name}{stat}' for name in SENSOR_COLUMNS for stat in ('', '_min', '_max')]
+        columns = self._devices.get(device)
+        count = columns.count if columns is not None else 0
+        if not count:
+            return {name: np.empty(0) for name in names}
+
+        width = resolution * 1000000
+        # Buckets starting before `end` are complete, as in the rollup table
+        positions = columns.select(_to_micros(start) // width * width, -(-_to_micros(end) // width) * width, count)
+        if not len(positions):
+            return {name: np.empty(0) for name in names}
+
+        buckets = columns.column('timestamp', count)[positions] // width
+        starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+        sizes = np.diff(np.append(starts, len(positions)))
+
+        result = {'timestamp': buckets[starts] * float(resolution) + resolution / 2.0, 'count': sizes.astype(np.float64)}
+        for name in SENSOR_COLUMNS:
+            values = np.array(columns.column(name, count)[positions], dtype=np.float64)
+            result[name] = np.add.reduceat(values, starts) / sizes
+            result[f'{name}_min'] = np.minimum.reduceat(values, starts)
+            result[f'{name}_max'] = np.maximum.reduceat(values, starts)
+        return result
@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from history import SENSOR_COLUMNS
+
+# Rolling features of the newest WINDOW readings of one device, per sensor:
+# mean, standard deviation, slope (units per second, least squares over the
+# window) and an exponentially weighted mean, plus the seconds since the
+# previous reading. Live inference updates one ring buffer per device in O(1)
+# per reading; training computes the same features for a whole table with
+# batch_features(). Both run the window arithmetic through _window_features()
+# in the same order, so they give bit-for-bit identical values.
+
+WINDOW = 10
+
+# Weight of the newest reading in the exponentially weighted mean. The weights
+# are truncated to the window so the value does not depend on older history.
+EWMA_ALPHA = 0.3
+
+STATS = ('mean', 'std', 'slope', 'ewma')
+
+FEATURE_COLUMNS = tuple(f'{name}_{stat}' for name in SENSOR_COLUMNS for stat in STATS) + ('time_diff',)
+
+EPOCH = datetime(1970, 1, 1)
+
+# Slot weights of the exponentially weighted mean, oldest slot first
+_EWMA_WEIGHTS = [(1 - EWMA_ALPHA) ** (WINDOW - 1 - slot) for slot in range(WINDOW)]
+
+
+# Unix seconds exactly as archive/training code gets them from datetime64[us]
+def to_seconds(timestamp):
+    return ((timestamp - EPOCH) // timedelta(microseconds=1)) / 1e6
+
+
+# Feature rows from the window slots. slot(i) returns (valid, times, values) for
+# slot i, 0 being the oldest and WINDOW - 1 the newest reading, shaped (n, 1),
+# (n, 1) and (n, sensors). The newest slot is always valid.
+def _window_features(slot):
+    slots = [slot(i) for i in range(WINDOW)]
+    newest_time = slots[-1][1]
+
+    count = 0.0
+    total = 0.0
+    weighted = 0.0
+    weights = 0.0
+    time_total = 0.0
+    for (valid, times, values), weight in zip(slots, _EWMA_WEIGHTS):
+        count = count + valid
+        total = total + np.where(valid, values, 0.0)
+        weighted = weighted + np.where(valid, values * weight, 0.0)
+        weights = weights + np.where(valid, weight, 0.0)
+        time_total = time_total + np.where(valid, times - newest_time, 0.0)
+    mean = total / count
+    ewma = weighted / weights
+    time_mean = time_total / count
+
+    squares = 0.0
+    covariance = 0.0
+    time_squares = 0.0
+    for valid, times, values in slots:
+        deviation = values - mean
+        time_deviation = times - newest_time - time_mean
+        squares = squares + np.where(valid, deviation * deviation, 0.0)
+        covariance = covariance + np.where(valid, time_deviation * deviation, 0.0)
+        time_squares = time_squares + np.where(valid, time_deviation * time_deviation, 0.0)
+    std = np.sqrt(squares / count)
+    # A single reading, or readings sharing one timestamp, have no slope
+    slope = np.where(time_squares > 0, covariance / np.where(time_squares > 0, time_squares, 1.0), 0.0)
+
+    valid, times, _ = slots[-2]
+    time_diff = np.where(valid, newest_time - times, 0.0)
+
+    # Same column order as FEATURE_COLUMNS
+    stats = np.stack([mean, std, slope, ewma], axis=2).reshape(len(mean), -1)
+    return np.concatenate([stats, time_diff], axis=1)
+
+
+# Features of every reading, for readings sorted by device and then time.
+# Windows never reach back into the previous device's readings.
+def batch_features(devices, timestamps, columns):
+    count = len(timestamps)
+    if not count:
+        return np.empty((0, len(FEATURE_COLUMNS)))
+    index = np.arange(count)
+    new_group = np.ones(count, dtype=bool)
+    new_group[1:] = devices[1:] != devices[:-1]
+    group_start = np.maximum.accumulate(np.where(new_group, index, 0))
+
+    times = np.asarray(timestamps, dtype=np.float64)[:, None]
+    values = np.column_stack([np.asarray(columns[name], dtype=np.float64) for name in SENSOR_COLUMNS])
+
+    def slot(i):
+        position = index - (WINDOW - 1 - i)
+        valid = (position >= group_start)[:, None]
+        position = np.maximum(position, 0)
+        return valid, times[position], values[position]
+
+    return _window_features(slot)
+
+
+# Ring buffer of one device's newest readings
+class RollingWindow:
+    def __init__(self):
+        self.times = np.zeros(WINDOW)
+        self.values = np.zeros((WINDOW, len(SENSOR_COLUMNS)))
+        self.count = 0
+        self.head = 0  # Slot the next reading is written to
+        self.last_timestamp = None
+
+    # Add a SensorData row, O(1). Readings older than the newest one are ignored.
+    def update(self, row):
+        seconds = to_seconds(row['timestamp'])
+        if self.count and seconds < self.times[(self.head - 1) % WINDOW]:
+            return False
+        self.times[self.head] = seconds
+        self.values[self.head] = [row[name] for name in SENSOR_COLUMNS]
+        self.head = (self.head + 1) % WINDOW
+        self.count = min(self.count + 1, WINDOW)
+        self.last_timestamp = row['timestamp']
+        return True
+
+    # Feature row (1, len(FEATURE_COLUMNS)) of the newest reading, None while empty
+    def vector(self):
+        if not self.count:
+            return None
+
+        def slot(i):
+            position = (self.head + i) % WINDOW
+            valid = np.array([[i >= WINDOW - self.count]])
+            return valid, self.times[position:position + 1, None], self.values[position:position + 1]
+
+        return _window_features(slot)
@@ -0,0 +1,396 @@
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+import joblib
+import numpy as np
+from sqlalchemy import text
+
+import archive
+import features
+import metrics
+from history import SENSOR_COLUMNS, db_time
+from rollups import ALARM_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Alarms the forecaster predicts (light has no alarm rule by default)
+FORECAST_ALARMS = ('temp_alarm', 'humidity_alarm', 'pressure_alarm', 'tvoc_alarm', 'smoke_alarm')
+
+# A reading is labelled with the alarms raised on the same device within this many seconds after it
+HORIZON = 300
+
+# Trained models are kept as <models_dir>/forecast-v<version>.joblib, newest version wins
+MODEL_PATTERN = re.compile(r'^forecast-v(\d+)\.joblib$')
+KEEP_VERSIONS = 5
+
+TRAINING_QUERY = text(
+    "SELECT device_id, timestamp, " + ", ".join(SENSOR_COLUMNS + ALARM_COLUMNS)
+    + " FROM sensor_data WHERE timestamp >= :since"
+)
+
+
+# Readings of all devices since `since` (archived ones included) as column arrays,
+# sorted by device and then time
+def load_training_columns(engine, archive_dir, since):
+    with engine.connect() as connection:
+        rows = connection.execute(TRAINING_QUERY, {'since': db_time(since)}).fetchall()
+
+    columns = {
+        'device_id': np.array([row[0] for row in rows], dtype='U32'),
+        'timestamp': np.array([row[1] for row in rows], dtype='datetime64[us]').astype(np.int64) / 1e6
+    }
+    for index, name in enumerate(SENSOR_COLUMNS + ALARM_COLUMNS, start=2):
+        columns[name] = np.array([row[index] for row in rows], dtype=np.float64)
+
+    if archive_dir:
+        archived = archive.read_columns(archive_dir, start=since)
+        if len(archived['timestamp']):
+            columns = {name: np.concatenate([archived[name].astype(values.dtype), values])
+                       for name, values in columns.items()}
+
+    order = np.lexsort((columns['timestamp'], columns['device_id']))
+    return {name: values[order] for name, values in columns.items()}
+
+
+def _group_starts(devices):
+    new_group = np.ones(len(devices), dtype=bool)
+    new_group[1:] = devices[1:] != devices[:-1]
+    return new_group
+
+
+# 1 where `flags` is raised on a later reading of the same device at most `horizon` seconds away
+def future_labels(devices, timestamps, flags, horizon=HORIZON):
+    count = len(timestamps)
+    if not count:
+        return np.zeros(0, dtype=np.int8)
+    group = np.cumsum(_group_starts(devices)) - 1
+    # Spread the devices apart on one time axis so a single searchsorted covers all of them
+    span = timestamps.max() - timestamps.min() + horizon + 1
+    key = group * span + (timestamps - timestamps.min())
+    end = np.searchsorted(key, key + horizon, side='right')
+    raised = np.concatenate(([0], np.cumsum(flags > 0)))
+    return (raised[end] - raised[np.arange(count) + 1] > 0).astype(np.int8)
+
+
+# Model bundles carry this number; bundles of an older layout are not loaded
+MODEL_FORMAT = 2
+
+# Trees grown by a full training, and added by each incremental update. Past
+# MAX_ESTIMATORS the oldest trees are dropped, so the forest follows recent behaviour.
+N_ESTIMATORS = 100
+ADD_ESTIMATORS = 20
+MAX_ESTIMATORS = 300
+
+# Share of the newest labelled readings held out to measure a full training
+TEST_SHARE = 0.2
+
+# Incremental updates also load this many seconds before the first new reading,
+# so the feature windows of the new readings are complete
+CONTEXT_SECONDS = 3600
+
+
+# Features and alarm labels of the readings whose horizon has fully passed
+# (and, if given, that are newer than `after`), with their timestamps and the
+# time up to which readings are labelled
+def training_set(columns, horizon, after=None):
+    devices, timestamps = columns['device_id'], columns['timestamp']
+    matrix = features.batch_features(devices, timestamps, columns)
+    targets = np.column_stack([future_labels(devices, timestamps, columns[alarm], horizon)
+                               for alarm in FORECAST_ALARMS])
+
+    # Whether the newest readings are followed by an alarm is not known yet
+    until = timestamps.max() - horizon
+    usable = timestamps <= until
+    if after is not None:
+        usable &= timestamps > after
+    return matrix[usable], targets[usable], timestamps[usable], until
+
+
+def _new_model(n_estimators, n_jobs):
+    from sklearn.ensemble import RandomForestClassifier
+
+    # One forest predicts every alarm (multi-output), its trees are grown on all cores
+    return RandomForestClassifier(n_estimators=n_estimators, n_jobs=n_jobs, random_state=42)
+
+
+def _fit(model, matrix, targets):
+    # Two zero-weight anchor rows make classes 0 and 1 of every alarm known to each
+    # fit, even when no new reading raised an alarm, so trees grown by different
+    # runs predict the same classes and can share one forest
+    anchors = np.zeros((2, matrix.shape[1]))
+    anchor_targets = np.array([[0] * len(FORECAST_ALARMS), [1] * len(FORECAST_ALARMS)])
+    weights = np.concatenate([np.ones(len(matrix)), np.zeros(2)])
+    model.fit(np.vstack([matrix, anchors]), np.vstack([targets, anchor_targets]), sample_weight=weights)
+
+
+def _accuracy(model, matrix, targets):
+    predicted = model.predict(matrix)
+    return {alarm: float(np.mean(predicted[:, index] == targets[:, index]))
+            for index, alarm in enumerate(FORECAST_ALARMS)}
+
+
+# Peak resident memory of this process in MB, None where the platform does not report it
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _report(mode, started, rows, test_rows, model, accuracy):
+    return {
+        'mode': mode,
+        'rows': rows,
+        'test_rows': test_rows,
+        'estimators': len(model.estimators_),
+        'wall_seconds': round(time.perf_counter() - started, 3),
+        'peak_memory_mb': peak_memory_mb(),
+        'accuracy': accuracy
+    }
+
+
+# Train a new forest on the given columns (see load_training_columns).
+# Accuracy is measured on a time-ordered split: a forest trained on the older
+# readings predicts the newest TEST_SHARE of them. The forest that is kept is
+# then trained on every labelled reading. Returns the bundle save_model() persists.
+def train(columns, horizon=HORIZON, n_estimators=N_ESTIMATORS, n_jobs=-1):
+    started = time.perf_counter()
+    matrix, targets, timestamps, until = training_set(columns, horizon)
+    if not len(matrix):
+        raise ValueError(f"no readings older than the {horizon} s horizon to learn from")
+
+    # Training readings whose horizon reaches into the test period would leak its labels
+    cutoff = np.quantile(timestamps, 1 - TEST_SHARE)
+    train_rows = timestamps < cutoff - horizon
+    test_rows = timestamps >= cutoff
+    accuracy = {}
+    if train_rows.any() and test_rows.any():
+        model = _new_model(n_estimators, n_jobs)
+        _fit(model, matrix[train_rows], targets[train_rows])
+        accuracy = _accuracy(model, matrix[test_rows], targets[test_rows])
+
+    model = _new_model(n_estimators, n_jobs)
+    _fit(model, matrix, targets)
+
+    return {
+        'format': MODEL_FORMAT,
+        'trained_at': datetime.utcnow(),
+        'trained_until': until,
+        'rows': len(matrix),
+        'horizon': horizon,
+        'features': features.FEATURE_COLUMNS,
+        'alarms': FORECAST_ALARMS,
+        'model': model,
+        'report': _report('full', started, len(matrix), int(test_rows.sum()), model, accuracy)
+    }
+
+
+# Grow ADD_ESTIMATORS more trees on the readings labelled since the bundle was
+# trained, leaving the existing trees as they are. Accuracy is that of the
+# previous forest on those readings, which it has never seen.
+# Returns the updated bundle, or None when there is nothing new to learn from.
+def update(bundle, columns, add_estimators=ADD_ESTIMATORS, n_jobs=-1):
+    started = time.perf_counter()
+    matrix, targets, _, until = training_set(columns, bundle['horizon'], after=bundle['trained_until'])
+    if not len(matrix):
+        return None
+
+    model = bundle['model']
+    accuracy = _accuracy(model, matrix, targets)
+    model.set_params(warm_start=True, n_jobs=n_jobs, n_estimators=len(model.estimators_) + add_estimators)
+    _fit(model, matrix, targets)
+    if len(model.estimators_) > MAX_ESTIMATORS:
+        model.estimators_ = model.estimators_[-MAX_ESTIMATORS:]
+        model.set_params(n_estimators=MAX_ESTIMATORS)
+
+    return dict(
+        bundle,
+        trained_at=datetime.utcnow(),
+        trained_until=until,
+        rows=bundle['rows'] + len(matrix),
+        model=model,
+        report=_report('incremental', started, len(matrix), len(matrix), model, accuracy)
+    )
+
+
+def list_versions(models_dir):
+    if not os.path.isdir(models_dir):
+        return []
+    matches = (MODEL_PATTERN.match(name) for name in os.listdir(models_dir))
+    return sorted(int(match.group(1)) for match in matches if match)
+
+
+def model_path(models_dir, version):
+    return os.path.join(models_dir, f'forecast-v{version}.joblib')
+
+
+# Store the bundle as the next version and drop all but the newest KEEP_VERSIONS.
+# Its training report is appended to <models_dir>/training.jsonl.
+def save_model(bundle, models_dir):
+    os.makedirs(models_dir, exist_ok=True)
+    versions = list_versions(models_dir)
+    version = versions[-1] + 1 if versions else 1
+    bundle = dict(bundle, version=version)
+
+    path = model_path(models_dir, version)
+    # Write to a temporary file first so the server never loads half a model
+    temporary = path + '.tmp'
+    joblib.dump(bundle, temporary)
+    os.replace(temporary, path)
+
+    for old in (versions + [version])[:-KEEP_VERSIONS]:
+        os.remove(model_path(models_dir, old))
+
+    with open(os.path.join(models_dir, 'training.jsonl'), 'a') as f:
+        f.write(json.dumps({'version': version, 'trained_at': bundle['trained_at'].isoformat(), **bundle['report']}) + '\n')
+    return version
+
+
+def load_model(models_dir, version=None):
+    versions = list_versions(models_dir)
+    if not versions:
+        return None
+    return joblib.load(model_path(models_dir, version if version is not None else versions[-1]))
+
+
+# Probability of every alarm the bundle predicts, one array per alarm
+def _probabilities(bundle, matrix):
+    model = bundle['model']
+    return {alarm: probability[:, list(classes).index(1)]
+            for alarm, classes, probability in zip(bundle['alarms'], model.classes_, model.predict_proba(matrix))}
+
+
+# Keeps per-device rolling features up to date from live readings and
+# forecasts, with the newest trained model, which alarms each device will
+# raise within the model's horizon. Forecasts are recomputed every `interval`
+# seconds for the devices that reported since, and `notify(payload)` is called
+# whenever the set of predicted alarms of a device changes. A newly trained
+# model version is picked up on the next interval, no restart needed.
+class ForecastService:
+    def __init__(self, models_dir, notify=None, interval=5.0, threshold=0.5):
+        self.models_dir = models_dir
+        self.notify = notify
+        self.interval = interval
+        self.threshold = threshold
+
+        self._bundle = None
+        self._rejected = None  # Version that failed to load, not retried
+        self._devices = {}
+        self._dirty = set()
+        self._forecasts = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.maybe_reload()
+
+    @property
+    def ready(self):
+        return self._bundle is not None
+
+    def maybe_reload(self):
+        versions = []
+        try:
+            versions = list_versions(self.models_dir)
+            if not versions or versions[-1] == self._rejected or \
+                    (self._bundle is not None and self._bundle['version'] == versions[-1]):
+                return
+            bundle = load_model(self.models_dir, versions[-1])
+            if bundle.get('format') != MODEL_FORMAT or tuple(bundle['features']) != features.FEATURE_COLUMNS:
+                raise ValueError(f"model v{versions[-1]} was trained by an older version, retrain it")
+            # Forecasts are a handful of rows at a time, threads would only add overhead
+            bundle['model'].set_params(n_jobs=1)
+        except Exception as e:
+            if versions:
+                self._rejected = versions[-1]
+            logger.error("Failed to load forecast model, keeping the previous one: %s", e)
+            return
+        with self._lock:
+            self._bundle = bundle
+            # Every forecast has to be redone with the new model
+            self._dirty.update(self._devices)
+        logger.info("Loaded forecast model v%s trained on %d readings", bundle['version'], bundle['rows'])
+
+    # Feed accepted readings (SensorData rows, any device, any order)
+    def observe(self, rows):
+        with self._lock:
+            for row in sorted(rows, key=lambda row: row['timestamp']):
+                window = self._devices.get(row['device_id'])
+                if window is None:
+                    window = self._devices[row['device_id']] = features.RollingWindow()
+                if window.update(row):
+                    self._dirty.add(row['device_id'])
+
+    def has_device(self, device):
+        return device in self._devices
+
+    # Newest reading in a device's rolling window, None before it has reported
+    def last_timestamp(self, device):
+        window = self._devices.get(device)
+        return window.last_timestamp if window is not None else None
+
+    # Current forecast of one device, None before the device has reported
+    def forecast(self, device):
+        if device in self._dirty or device not in self._forecasts:
+            self.refresh([device])
+        return self._forecasts.get(device)
+
+    # Recompute the forecasts of the given (default: all changed) devices
+    def refresh(self, devices=None):
+        with self._lock:
+            bundle = self._bundle
+            devices = [device for device in (self._dirty if devices is None else devices) if device in self._devices]
+            if bundle is None or not devices:
+                return
+            self._dirty.difference_update(devices)
+            matrix = np.concatenate([self._devices[device].vector() for device in devices])
+            readings = [self._devices[device].last_timestamp for device in devices]
+
+        probabilities = _probabilities(bundle, matrix)
+
+        for position, device in enumerate(devices):
+            payload = {
+                'device': device,
+                'model_version': bundle['version'],
+                'horizon': bundle['horizon'],
+                'timestamp': readings[position].strftime("%Y-%m-%d %H:%M:%S"),
+                'probabilities': {alarm: round(float(values[position]), 4) for alarm, values in probabilities.items()},
+                'alarms': [alarm for alarm, values in probabilities.items() if values[position] >= self.threshold]
+            }
+            previous = self._forecasts.get(device)
+            self._forecasts[device] = payload
+
+            if self.notify is not None and (previous['alarms'] if previous else []) != payload['alarms']:
+                started = time.perf_counter()
+                try:
+                    self.notify(payload)
+                except Exception as emit_error:
+                    logger.warning("Failed to emit forecast via WebSocket: %s", emit_error)
+                metrics.EMIT_SECONDS.observe(time.perf_counter() - started, ('predicted_alarm',))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='forecaster', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval * 2)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.maybe_reload()
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.exception("Failed to refresh forecasts: %s", e)
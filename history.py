@@ -0,0 +1,150 @@
+import json
+from datetime import datetime, timezone
+
+import numpy as np
+
+SENSOR_COLUMNS = ('temperature', 'humidity', 'pressure', 'light', 'tvoc', 'smoke')
+
+# Rows are read straight off the DBAPI cursor in chunks of this size
+FETCH_CHUNK = 65536
+
+# Values per JSON fragment when streaming a column
+STREAM_CHUNK = 8192
+
+# Timestamps are compared as the strings SQLAlchemy stores in SQLite, so the
+# (device_id, timestamp) index is used; julianday() hands them back as unix seconds
+RANGE_QUERY = (
+    "SELECT (julianday(timestamp) - 2440587.5) * 86400.0, "
+    + ", ".join(SENSOR_COLUMNS)
+    + " FROM sensor_data WHERE device_id = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp"
+)
+
+
+# Rollup buckets as the same columns, mean = sum / count and the bucket midpoint as time
+ROLLUP_QUERY = (
+    "SELECT (julianday(bucket_start) - 2440587.5) * 86400.0 + resolution / 2.0, count, "
+    + ", ".join(f"{name}_sum / count, {name}_min, {name}_max" for name in SENSOR_COLUMNS)
+    + " FROM sensor_rollup WHERE resolution = ? AND device_id = ? AND bucket_start >= ? AND bucket_start < ?"
+    " ORDER BY bucket_start"
+)
+
+
+# Parse ?from= / ?to=: unix seconds or ISO 8601 (naive times are UTC)
+def parse_time(value, default):
+    if value is None or value == '':
+        return default
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = None
+    if seconds is not None:
+        try:
+            return datetime.utcfromtimestamp(seconds)
+        except (ValueError, OverflowError, OSError):
+            # inf, nan or a year datetime cannot hold; the route answers 400 as for any bad input
+            raise ValueError(f"Time out of range: {value}")
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def db_time(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def _fetch_array(dbapi_connection, query, params, width):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(query, params)
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(FETCH_CHUNK)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.float64))
+    finally:
+        cursor.close()
+    return np.concatenate(chunks) if chunks else np.empty((0, width))
+
+
+# Fetch one device's readings in [start, end) as a dict of float64 column arrays
+def fetch_columns(dbapi_connection, device, start, end):
+    data = _fetch_array(dbapi_connection, RANGE_QUERY, (device, db_time(start), db_time(end)),
+                        len(SENSOR_COLUMNS) + 1)
+    columns = {'timestamp': data[:, 0]}
+    for index, name in enumerate(SENSOR_COLUMNS, start=1):
+        columns[name] = data[:, index]
+    return columns
+
+
+# Same as fetch_columns but from the rollup table, with per-bucket count, min and max
+def fetch_rollup_columns(dbapi_connection, device, resolution, start, end):
+    data = _fetch_array(dbapi_connection, ROLLUP_QUERY, (resolution, device, db_time(start), db_time(end)),
+                        3 * len(SENSOR_COLUMNS) + 2)
+    columns = {'timestamp': data[:, 0], 'count': data[:, 1]}
+    for index, name in enumerate(SENSOR_COLUMNS):
+        columns[name] = data[:, 2 + 3 * index]
+        columns[f'{name}_min'] = data[:, 3 + 3 * index]
+        columns[f'{name}_max'] = data[:, 4 + 3 * index]
+    return columns
+
+
+# Join older columns (e.g. from the archive) in front of newer ones
+def concat_columns(older, newer):
+    if not len(older['timestamp']):
+        return newer
+    return {name: np.concatenate([older[name].astype(np.float64), values]) for name, values in newer.items()}
+
+
+# Coarsest rollup whose buckets are still no wider than one output point, None for raw rows
+def pick_resolution(start, end, max_points, resolutions):
+    seconds_per_point = (end - start).total_seconds() / max_points
+    usable = [resolution for resolution in resolutions if resolution <= seconds_per_point]
+    return max(usable) if usable else None
+
+
+# Reduce the columns to at most max_points equal-time buckets.
+# Each bucket keeps the mean time and mean value plus the min and max of every
+# sensor, so short spikes survive downsampling. Rollup input is weighted by its
+# per-bucket count and keeps its own min/max. Fully vectorised with reduceat.
+def downsample(columns, max_points):
+    timestamps = columns['timestamp']
+    count = len(timestamps)
+
+    if count <= max_points:
+        result = {'timestamp': timestamps}
+        for name in SENSOR_COLUMNS:
+            result[name] = columns[name]
+            result[f'{name}_min'] = columns.get(f'{name}_min', columns[name])
+            result[f'{name}_max'] = columns.get(f'{name}_max', columns[name])
+        return result
+
+    edges = np.linspace(timestamps[0], timestamps[-1], max_points + 1)
+    # Index of the first sample in each bucket; empty buckets collapse into their neighbour
+    starts = np.unique(np.searchsorted(timestamps, edges[:-1], side='left'))
+    starts = starts[starts < count]
+
+    weights = columns.get('count')
+    if weights is None:
+        weights = np.ones(count)
+    totals = np.add.reduceat(weights, starts)
+
+    result = {'timestamp': np.add.reduceat(timestamps * weights, starts) / totals}
+    for name in SENSOR_COLUMNS:
+        result[name] = np.add.reduceat(columns[name] * weights, starts) / totals
+        result[f'{name}_min'] = np.minimum.reduceat(columns.get(f'{name}_min', columns[name]), starts)
+        result[f'{name}_max'] = np.maximum.reduceat(columns.get(f'{name}_max', columns[name]), starts)
+    return result
+
+
+# Stream the response column by column instead of building one large document
+def stream_json(header, columns):
+    yield json.dumps(header)[:-1]
+    for name, values in columns.items():
+        yield f', "{name}": ['
+        for offset in range(0, len(values), STREAM_CHUNK):
+            chunk = json.dumps(np.round(values[offset:offset + STREAM_CHUNK], 6).tolist())[1:-1]
+            yield chunk if offset == 0 else ', ' + chunk
+        yield ']'
+    yield '}'
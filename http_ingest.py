@@ -0,0 +1,92 @@
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from ingest import MAX_REQUEST_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+# HTTP front-end for the sensors on port 8080.
+# Every request is handled on its own thread (a green thread under eventlet),
+# so one slow board no longer blocks all the others.
+class RequestHandler(BaseHTTPRequestHandler):
+    # Every response carries Content-Length, so boards may keep the connection open
+    protocol_version = 'HTTP/1.1'
+    # Seconds a connection may sit idle (or stall mid-request) before its thread lets go,
+    # so boards that drop off WiFi do not hold handler threads forever
+    timeout = 30
+
+    def do_GET(self):
+        # Send a simple response for GET requests
+        self.send_text(200, "GET request handled successfully")
+
+    def do_POST(self):
+        try:
+            content_length = int(self.headers['Content-Length'])  # Get the size of the data
+        except (TypeError, ValueError):
+            self.send_text(411, "Content-Length required")
+            return
+        # The body is never read in these cases, so the connection cannot be reused
+        if content_length < 0:
+            self.close_connection = True
+            self.send_text(400, "Invalid Content-Length", {'Connection': 'close'})
+            return
+        if content_length > MAX_REQUEST_BYTES:
+            self.close_connection = True
+            self.send_text(413, f"Request body larger than {MAX_REQUEST_BYTES} bytes", {'Connection': 'close'})
+            return
+
+        post_data = self.rfile.read(content_length)  # Read the data
+
+        # Boards name themselves in the payload, the X-Device-ID header or ?device=
+        query = parse_qs(urlsplit(self.path).query)
+        device_id = self.headers.get('X-Device-ID') or query.get('device', [None])[0]
+
+        # Bulk uploads go to /receive_batch, any other path takes a single JSON reading
+        if self.path.split('?')[0] == '/receive_batch':
+            status, summary, headers = self.server.pipeline.ingest_batch(
+                post_data, self.headers.get('Content-Type', ''), device_id)
+            self.send_body(status, json.dumps(summary), 'application/json', headers)
+        else:
+            status, message, headers = self.server.pipeline.ingest_json(post_data, device_id)
+            self.send_text(status, message, headers)
+
+    def send_text(self, status, message, headers=None):
+        self.send_body(status, message, 'text/html', headers)
+
+    def send_body(self, status, message, content_type, headers=None):
+        body = message.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    # The access log goes through logging at DEBUG instead of stderr on every request
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class IngestHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # Listen backlog for bursts of boards reconnecting
+
+    # With listen_socket the server accepts on a socket that is already bound and
+    # listening, e.g. one shared by several forked worker processes
+    def __init__(self, server_address, pipeline, listen_socket=None):
+        self.pipeline = pipeline
+        super().__init__(server_address, RequestHandler, bind_and_activate=listen_socket is None)
+        if listen_socket is not None:
+            self.socket.close()
+            self.socket = listen_socket
+            self.server_address = listen_socket.getsockname()
+
+
+def serve(pipeline, host='', port=8080, listen_socket=None):
+    httpd = IngestHTTPServer((host, port), pipeline, listen_socket)
+    logger.info("HTTP Server running on port %d", port)
+    httpd.serve_forever()
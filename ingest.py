@@ -0,0 +1,342 @@
+import json
+import logging
+import math
+import re
+import struct
+import time
+from datetime import datetime, timedelta
+
+import metrics
+from alarm_rules import AlarmRuleEngine
+
+logger = logging.getLogger(__name__)
+
+
+# Fields sent by the SensorDuino firmware mapped to SensorData columns
+FIELD_MAP = {
+    'temperature': 'temperature',
+    'humidity': 'humidity',
+    'pressure': 'pressure',
+    'light': 'light',
+    'CH2O': 'tvoc',  # CH2O corresponds to TVOC in mg/m3
+    'gas': 'smoke'
+}
+
+# Fields the firmware may leave out and the value stored instead
+OPTIONAL_FIELDS = {'light': 0.0}
+
+
+# Device ID stored for readings from boards that do not identify themselves
+UNKNOWN_DEVICE = 'unknown'
+
+# Device IDs are the board's MAC address, but any short token of these characters is accepted
+DEVICE_ID_PATTERN = re.compile(r'^[A-Za-z0-9:_.-]{1,32}$')
+
+# Fixed-layout record used by /receive_batch with Content-Type application/octet-stream:
+# six little-endian float32 readings followed by a uint32 time field (28 bytes).
+# From MIN_CLOCK_TIME on the time field is unix seconds. Below it the board has
+# no clock yet and sends the reading's age in milliseconds at upload instead
+# (millis() now minus millis() when it was taken), see parse_timestamp.
+BATCH_RECORD = struct.Struct('<6fI')
+BATCH_RECORD_FIELDS = ('temperature', 'humidity', 'pressure', 'light', 'gas', 'CH2O')
+
+# Largest batch accepted in one request
+MAX_BATCH_RECORDS = 5000
+
+# Largest request body read from a board: a full batch, with room for NDJSON
+# lines being several times longer than the 28-byte binary record
+MAX_REQUEST_BYTES = MAX_BATCH_RECORDS * 256
+
+# Readings stamped further than this in the future are rejected (seconds)
+MAX_CLOCK_SKEW = 300
+
+# Smallest time field read as unix seconds (2001-09-09); anything below is an age in ms
+MIN_CLOCK_TIME = 1000000000
+
+# Firmware from before record ages sends 0 for every reading taken without a clock;
+# several of them in one batch are spread back from the receive time this far apart
+# (milliseconds, one pass of the firmware's loop) instead of sharing one timestamp
+UNDATED_RECORD_SPACING = 4000
+
+
+class InvalidReading(ValueError):
+    pass
+
+
+# Turn a decoded JSON payload into the sensor columns of a SensorData row
+def parse_reading(sensor_data):
+    if not isinstance(sensor_data, dict):
+        raise InvalidReading("Reading must be a JSON object")
+
+    reading = {}
+    for field, column in FIELD_MAP.items():
+        value = sensor_data.get(field, OPTIONAL_FIELDS.get(field))
+        if value is None:
+            raise InvalidReading(f"Missing field '{field}'")
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise InvalidReading(f"Field '{field}' is not a number")
+        if not math.isfinite(value):
+            raise InvalidReading(f"Field '{field}' is not a finite number")
+        reading[column] = value
+    return reading
+
+
+# Device that sent a reading, falling back to the given default
+def parse_device_id(value, default=UNKNOWN_DEVICE):
+    if value is None or value == '':
+        return default
+    if not isinstance(value, str) or not DEVICE_ID_PATTERN.match(value.strip()):
+        raise InvalidReading("Field 'device' is not a valid device ID")
+    return value.strip()
+
+
+# Timestamp of a reading: unix seconds from the board; without them the receive
+# time, less the reading's age in milliseconds if the board sent one
+def parse_timestamp(value, received_at, age=None):
+    if not value:
+        if not age:
+            return received_at
+        try:
+            age = float(age)
+        except (TypeError, ValueError):
+            raise InvalidReading("Field 'age' is not a number")
+        if not 0 <= age < MIN_CLOCK_TIME:
+            raise InvalidReading("Field 'age' is out of range")
+        return received_at - timedelta(milliseconds=age)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise InvalidReading("Field 'timestamp' is not a number")
+    if not math.isfinite(value) or value < 0 or value > time.time() + MAX_CLOCK_SKEW:
+        raise InvalidReading("Field 'timestamp' is out of range")
+    return datetime.utcfromtimestamp(value)
+
+
+# Split a binary batch into firmware-style reading dicts
+def iter_binary_records(body):
+    if len(body) % BATCH_RECORD.size:
+        raise InvalidReading(f"Batch length {len(body)} is not a multiple of {BATCH_RECORD.size} bytes")
+    for record in BATCH_RECORD.iter_unpack(body):
+        sensor_data = dict(zip(BATCH_RECORD_FIELDS, record))
+        if record[-1] >= MIN_CLOCK_TIME:
+            sensor_data['timestamp'] = record[-1]
+        else:
+            sensor_data['age'] = record[-1]
+        yield sensor_data
+
+
+# Spread readings that carry neither a timestamp nor an age (older firmware, NDJSON
+# clients without a clock) back from the receive time, the last one newest
+def space_undated(records):
+    undated = [sensor_data for sensor_data in records
+               if isinstance(sensor_data, dict) and not sensor_data.get('timestamp') and not sensor_data.get('age')]
+    if len(undated) > 1:
+        for position, sensor_data in enumerate(reversed(undated)):
+            sensor_data['age'] = position * UNDATED_RECORD_SPACING
+
+
+# Split a newline-delimited JSON batch, a line that does not decode is passed on as None
+def iter_ndjson_records(body):
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            yield None
+
+
+# JSON view of a row, pushed to dashboards and served by /get_latest_data
+def reading_payload(row):
+    return {
+        'device': row['device_id'],
+        'temperature': row['temperature'],
+        'humidity': row['humidity'],
+        'pressure': row['pressure'],
+        'light': row['light'],
+        'tvoc': row['tvoc'],
+        'smoke': row['smoke'],
+        'temp_alarm': row['temp_alarm'],
+        'humidity_alarm': row['humidity_alarm'],
+        'pressure_alarm': row['pressure_alarm'],
+        'light_alarm': row['light_alarm'],
+        'tvoc_alarm': row['tvoc_alarm'],
+        'smoke_alarm': row['smoke_alarm'],
+        'anomaly_flags': row.get('anomaly_flags', 0),
+        'timestamp': row['timestamp'].strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+
+# Single ingestion core shared by every HTTP front-end:
+# parse -> validate -> alarm evaluation -> anomaly detection -> persist (via the write-behind queue) -> broadcast
+class IngestPipeline:
+    def __init__(self, queue, broadcast, latest=None, rules=None, forecaster=None, detector=None, alert=None):
+        self.queue = queue
+        self.broadcast = broadcast  # None in processes that push nothing to dashboards (ingest workers)
+        self.latest = latest  # Optional LatestCache kept up to date with every accepted reading
+        self.rules = rules if rules is not None else AlarmRuleEngine()
+        self.forecaster = forecaster  # Optional ForecastService fed every accepted reading
+        self.detector = detector  # Optional anomaly.AnomalyDetector setting row['anomaly_flags']
+        self.alert = alert  # Called with the detector's report when a device's anomalies change
+
+    # Returns (status code, response body, extra headers) for the front-end to send.
+    # device_id comes from the X-Device-ID header or ?device=, as for ingest_batch,
+    # and applies when the reading does not name its own device.
+    def ingest_json(self, body, device_id=None):
+        started = time.perf_counter()
+        try:
+            sensor_data = json.loads(body.decode('utf-8') if isinstance(body, bytes) else body)
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            logger.warning("Failed to decode JSON data")
+            metrics.DROPPED.inc(1, ('invalid',))
+            return 400, "Invalid data format", {}
+        return self.ingest(sensor_data, started, device_id)
+
+    def ingest(self, sensor_data, started=None, device_id=None):
+        started = time.perf_counter() if started is None else started
+        metrics.REQUEST_READINGS.observe(1)
+        try:
+            row = self.build_row(sensor_data, datetime.utcnow(), parse_device_id(device_id))
+        except InvalidReading as e:
+            logger.warning("Rejected sensor data: %s", e)
+            metrics.DROPPED.inc(1, ('invalid',))
+            return 400, "Invalid data format", {}
+        metrics.PARSE_SECONDS.observe(time.perf_counter() - started)
+
+        logger.debug("Received sensor data: %s", sensor_data)
+
+        if not self.queue.reserve(1):
+            logger.warning("Ingest queue full, rejecting reading")
+            metrics.DROPPED.inc(1, ('queue_full',))
+            return 503, "Server busy, retry later", {'Retry-After': '1'}
+        self.evaluate_reserved([row])
+
+        self.publish([row])
+        return 200, "Data received successfully", {}
+
+    # Bulk upload: the body is either packed BATCH_RECORD structs or NDJSON.
+    # Returns (status code, JSON-serialisable summary, extra headers).
+    # device_id comes from the X-Device-ID header or ?device= and applies to
+    # every record that does not name its own device.
+    def ingest_batch(self, body, content_type, device_id=None):
+        started = time.perf_counter()
+        received_at = datetime.utcnow()
+        try:
+            device_id = parse_device_id(device_id)
+            if content_type.startswith('application/octet-stream'):
+                records = list(iter_binary_records(body))
+            else:
+                records = list(iter_ndjson_records(body))
+        except InvalidReading as e:
+            logger.warning("Rejected sensor batch: %s", e)
+            return 400, {'accepted': 0, 'rejected': 0, 'error': str(e)}, {}
+
+        metrics.REQUEST_READINGS.observe(len(records))
+        if len(records) > MAX_BATCH_RECORDS:
+            metrics.DROPPED.inc(len(records), ('invalid',))
+            return 413, {'accepted': 0, 'rejected': len(records),
+                         'error': f"At most {MAX_BATCH_RECORDS} records per batch"}, {}
+        space_undated(records)
+
+        rows = []
+        errors = []
+        for index, sensor_data in enumerate(records):
+            try:
+                rows.append(self.build_row(sensor_data, received_at, device_id))
+            except InvalidReading as e:
+                errors.append({'index': index, 'error': str(e)})
+        if errors:
+            metrics.DROPPED.inc(len(errors), ('invalid',))
+
+        metrics.PARSE_SECONDS.observe(time.perf_counter() - started)
+
+        # The whole batch is queued or refused, so a retry never duplicates readings
+        if rows and not self.queue.reserve(len(rows)):
+            logger.warning("Ingest queue full, rejecting batch of %d", len(rows))
+            metrics.DROPPED.inc(len(rows), ('queue_full',))
+            return 503, {'accepted': 0, 'rejected': len(records), 'error': "Server busy, retry later"}, \
+                {'Retry-After': '1'}
+        if rows:
+            self.evaluate_reserved(rows)
+
+        logger.debug("Received sensor batch: %d accepted, %d rejected", len(rows), len(errors))
+
+        self.publish(rows)
+
+        # Only report the first few errors to keep the response small for the board
+        return 200, {'accepted': len(rows), 'rejected': len(errors), 'errors': errors[:20]}, {}
+
+    def build_row(self, sensor_data, received_at, device_id=UNKNOWN_DEVICE):
+        row = parse_reading(sensor_data)
+        row['device_id'] = parse_device_id(sensor_data.get('device'), device_id)
+        row['timestamp'] = parse_timestamp(sensor_data.get('timestamp'), received_at, sensor_data.get('age'))
+        row['anomaly_flags'] = 0
+        return row
+
+    # Alarm flags and anomaly detection for rows the queue has already made room for,
+    # then hand them over: a reading refused with 503 never advances the per-device
+    # state, so the board's retry of it is evaluated as new
+    def evaluate_reserved(self, rows):
+        try:
+            started = time.perf_counter()
+            self.rules.evaluate(rows)
+            metrics.ALARM_SECONDS.observe(time.perf_counter() - started)
+            self.detect(rows)
+        except Exception:
+            self.queue.release(len(rows))
+            raise
+        self.queue.put_reserved(rows)
+
+    # Set anomaly_flags on every row, run after the alarm rules; the detector's state
+    # is per device, so a multi-process setup runs it in the one writer instead
+    def detect(self, rows):
+        if self.detector is None or not rows:
+            return
+        started = time.perf_counter()
+        self.detector.process(rows)
+        metrics.ANOMALY_SECONDS.observe(time.perf_counter() - started)
+
+    # Refresh the latest-value cache and notify dashboards with the newest
+    # reading per device; older readings from the same batch are only stored
+    # (and fed to the forecaster, whose rolling features need all of them)
+    def publish(self, rows):
+        if self.forecaster is not None:
+            self.forecaster.observe(rows)
+
+        newest = {}
+        counts = {}
+        anomalies = {}  # device -> readings with anomalies and the union of their flags
+        for row in rows:
+            current = newest.get(row['device_id'])
+            if current is None or row['timestamp'] >= current['timestamp']:
+                newest[row['device_id']] = row
+            counts[row['device_id']] = counts.get(row['device_id'], 0) + 1
+            if row.get('anomaly_flags'):
+                flagged, flags = anomalies.get(row['device_id'], (0, 0))
+                anomalies[row['device_id']] = (flagged + 1, flags | row['anomaly_flags'])
+
+        for device_id, row in newest.items():
+            metrics.READINGS.inc(counts[device_id], (device_id,))
+            flagged, flags = anomalies.get(device_id, (0, 0))
+            if flagged:
+                metrics.ANOMALIES.inc(flagged, (device_id,))
+            if self.detector is not None and self.alert is not None:
+                report = self.detector.report(device_id, row['timestamp'], flags)
+                if report is not None:
+                    try:
+                        self.alert(report)
+                    except Exception as emit_error:
+                        logger.warning("Failed to emit anomaly alert: %s", emit_error)
+            if self.broadcast is None:
+                continue
+            payload = reading_payload(row)
+            if self.latest is not None:
+                self.latest.update(device_id, row['timestamp'], payload)
+
+            # Broadcasting is best effort, the reading is already queued for the database
+            try:
+                self.broadcast(payload)
+            except Exception as emit_error:
+                logger.warning("Failed to emit data via WebSocket: %s", emit_error)
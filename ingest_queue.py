@@ -0,0 +1,123 @@
+import logging
+import queue
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Bounded write-behind queue for sensor readings.
+# Request handlers put validated rows on the queue and return straight away;
+# a background writer drains it and hands the rows to flush_fn in bulk, either
+# when batch_size rows have piled up or flush_interval seconds after the first
+# row of the batch arrived, whichever comes first.
+class IngestQueue:
+    def __init__(self, flush_fn, max_size=10000, batch_size=500, flush_interval=0.25):
+        self.flush_fn = flush_fn
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        # Counters for rows that made it to the database and rows that were lost
+        self.written = 0
+        self.dropped = 0
+
+        # The queue itself is unbounded and holds lists of rows; the bound is
+        # enforced on the row count so a batch upload is accepted or refused whole
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+            self._thread.start()
+
+    def put(self, row):
+        return self.put_many([row])
+
+    def put_many(self, rows):
+        if not self.reserve(len(rows)):
+            return False
+        self.put_reserved(rows)
+        return True
+
+    # Claim room for `count` rows before handing them over, so the pipeline only
+    # updates per-device state (alarm rules, anomaly detector) for readings that
+    # will be stored. Every successful reserve() is followed by put_reserved()
+    # with that many rows, or by release(count).
+    def reserve(self, count):
+        # Never block the request handler: a full (or stopping) queue returns
+        # False so the caller can answer with 503 and the sensor retries later;
+        # once stop() has begun nothing new is admitted
+        with self._lock:
+            if self._stop.is_set() or self._pending + count > self.max_size:
+                return False
+            self._pending += count
+        return True
+
+    def put_reserved(self, rows):
+        self._queue.put(rows)
+
+    def release(self, count):
+        with self._lock:
+            self._pending -= count
+
+    def depth(self):
+        return self._pending
+
+    def stop(self, timeout=10.0):
+        # Refuse new rows, then wait for the writer to flush what is already queued
+        # (an empty list wakes it up instead of letting it sleep out the flush interval)
+        self._stop.set()
+        self._queue.put([])
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        batch = []
+        deadline = None
+
+        while True:
+            wait = self.flush_interval if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                batch.extend(self._queue.get(timeout=wait))
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+                # Grab whatever else is already waiting without sleeping again
+                while len(batch) < self.batch_size:
+                    batch.extend(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+                deadline = None
+
+            # Rows reserved before the stop are still on their way: wait for their
+            # put_reserved() (or release()) instead of leaving them behind
+            if self._stop.is_set() and self._queue.empty() and self._pending <= len(batch):
+                if batch:
+                    self._flush(batch)
+                break
+
+    def _flush(self, batch):
+        with self._lock:
+            self._pending -= len(batch)
+        metrics.COMMIT_READINGS.observe(len(batch))
+        started = time.perf_counter()
+        try:
+            self.flush_fn(batch)
+            self.written += len(batch)
+        except Exception as flush_error:
+            self.dropped += len(batch)
+            metrics.DROPPED.inc(len(batch), ('write_failed',))
+            logger.error("Failed to write %d readings to the database: %s", len(batch), flush_error)
+        metrics.COMMIT_SECONDS.observe(time.perf_counter() - started)
@@ -0,0 +1,194 @@
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import sys
+
+import http_ingest
+import metrics
+from ingest import IngestPipeline
+
+logger = logging.getLogger(__name__)
+
+# Headless ingestion for hosts that only receive data (`python cli.py ingest`).
+# The parent process opens the sensor port and forks `workers` processes that
+# all accept connections on it. Workers only parse and validate readings and
+# pass the rows over a multiprocessing queue to the parent, the one writer:
+# it evaluates the alarm rules (their state is per device, so every reading
+# of a board has to go through the same engine) and hands the rows to the
+# usual IngestQueue -> SensorStore path. Workers are forked before the parent
+# imports SQLAlchemy or opens the store, so they start in milliseconds.
+# The anomaly detector keeps per-device state too and runs in the writer after the rules.
+# With a message_queue URL the writer also pushes the newest reading per device
+# (alarm and anomaly flags included), anomaly alerts and, with a models_dir,
+# changed alarm forecasts to dashboards, through whichever web workers hold them.
+# With a metrics_port the writer serves its /metrics (queue depth, alarm, anomaly
+# and commit timings, readings written or dropped at write time). The workers'
+# own counters (parse timings, invalid and queue_full drops) stay in the worker
+# processes and are not included.
+
+
+# Stand-in for IngestQueue in a worker: the bound on readings in flight is
+# shared by all workers, so a full writer still answers 503 from every worker
+class ForwardingQueue:
+    def __init__(self, readings, in_flight, max_size):
+        self.readings = readings
+        self.in_flight = in_flight
+        self.max_size = max_size
+
+    def put(self, row):
+        return self.put_many([row])
+
+    def put_many(self, rows):
+        if not self.reserve(len(rows)):
+            return False
+        self.put_reserved(rows)
+        return True
+
+    def reserve(self, count):
+        with self.in_flight.get_lock():
+            if self.in_flight.value + count > self.max_size:
+                return False
+            self.in_flight.value += count
+        return True
+
+    def put_reserved(self, rows):
+        self.readings.put(rows)
+
+    def release(self, count):
+        with self.in_flight.get_lock():
+            self.in_flight.value -= count
+
+    def depth(self):
+        return self.in_flight.value
+
+
+# Alarm and anomaly flags are set by the writer, see above
+class WriterEvaluatesAlarms:
+    def evaluate(self, rows):
+        return rows
+
+
+def _serve(listener, port, readings, in_flight, max_size):
+    # The parent decides when to stop: Ctrl-C goes to the whole process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    pipeline = IngestPipeline(ForwardingQueue(readings, in_flight, max_size), None, rules=WriterEvaluatesAlarms())
+    http_ingest.serve(pipeline, port=port, listen_socket=listener)
+
+
+def run(open_store, rules_path=None, host='', port=8080, workers=None, queue_size=10000, batch_size=500,
+        flush_interval=0.25, message_queue=None, coalesce_interval=1.0, metrics_port=None, models_dir=None,
+        forecast_interval=5.0, forecast_threshold=0.5):
+    workers = workers or os.cpu_count() or 1
+    listener = socket.create_server((host, port), backlog=128)
+    context = multiprocessing.get_context('fork')
+    readings = context.Queue()
+    in_flight = context.Value('q', 0)
+
+    processes = [context.Process(target=_serve, args=(listener, port, readings, in_flight, queue_size),
+                                 name=f'ingest-worker-{number}', daemon=True)
+                 for number in range(workers)]
+    for process in processes:
+        process.start()
+    listener.close()
+    logger.info("%d ingest worker(s) accepting on port %d", workers, port)
+
+    # Only the writer needs the database stack
+    from alarm_rules import AlarmRuleEngine
+    from anomaly import AnomalyDetector
+    from ingest_queue import IngestQueue
+
+    sensor_store = open_store()
+    sensor_store.start()
+    rules = AlarmRuleEngine(rules_path)
+
+    def write(rows):
+        try:
+            sensor_store.append(rows)
+        finally:
+            with in_flight.get_lock():
+                in_flight.value -= len(rows)
+
+    # Sized like the shared bound, so what the workers accepted always fits
+    ingest_queue = IngestQueue(write, max_size=queue_size, batch_size=batch_size, flush_interval=flush_interval)
+    ingest_queue.start()
+
+    # Readings the workers accepted that are not stored yet, in the queue between the processes or the writer's
+    metrics.QUEUE_DEPTH.set_function(lambda: in_flight.value)
+    metrics_server = None
+    if metrics_port:
+        metrics_server = metrics.start_http_server(metrics_port, host)
+        logger.info("Writer metrics on port %d", metrics_port)
+
+    broadcaster = None
+    alert = None
+    forecaster = None
+    if message_queue:
+        from flask_socketio import SocketIO
+
+        from broadcaster import CoalescingBroadcaster, device_room
+
+        # Write-only: emits go to the queue, the web workers deliver them to their rooms
+        emitter = SocketIO(message_queue=message_queue)
+        broadcaster = CoalescingBroadcaster(lambda event, payload, room: emitter.emit(event, payload, to=room),
+                                            interval=coalesce_interval)
+        broadcaster.start()
+
+        def alert(report):
+            emitter.emit('sensor_anomaly', report, to=device_room(report['device']))
+
+        if models_dir:
+            from forecast import ForecastService
+
+            # The web workers see no readings in this setup, so the writer keeps the
+            # rolling windows and pushes predicted_alarm like app.py's forecaster does
+            forecaster = ForecastService(
+                models_dir, lambda payload: emitter.emit('predicted_alarm', payload, to=device_room(payload['device'])),
+                interval=forecast_interval, threshold=forecast_threshold)
+            forecaster.start()
+
+    # Only used to flag and publish what the writer accepted
+    pipeline = IngestPipeline(ingest_queue, broadcaster.publish if broadcaster else None, rules=rules,
+                              forecaster=forecaster, detector=AnomalyDetector(), alert=alert)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            try:
+                rows = readings.get(timeout=1.0)
+            except queue.Empty:
+                if not all(process.is_alive() for process in processes):
+                    logger.error("An ingest worker exited, shutting down")
+                    break
+                continue
+            rules.evaluate(rows)
+            pipeline.detect(rows)
+            ingest_queue.put_many(rows)
+            pipeline.publish(rows)
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Stopping ingest workers")
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(5)
+        # Whatever the workers accepted before they stopped is still written
+        while True:
+            try:
+                rows = readings.get(timeout=0.5)
+            except queue.Empty:
+                break
+            rules.evaluate(rows)
+            pipeline.detect(rows)
+            ingest_queue.put_many(rows)
+        ingest_queue.stop()
+        sensor_store.close()
+        if broadcaster is not None:
+            broadcaster.stop()
+        if forecaster is not None:
+            forecaster.stop()
+        if metrics_server is not None:
+            metrics_server.shutdown()
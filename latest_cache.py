@@ -0,0 +1,35 @@
+import os
+import threading
+
+
+# In-process snapshot of the newest reading per device.
+# The ingestion pipeline updates it as readings are accepted, so /get_latest_data
+# can answer (or reply 304 Not Modified) without touching the database.
+class LatestCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # device -> (timestamp, etag, data)
+        self._newest = None  # Device with the most recent reading overall
+        self._version = 0
+        # ETags must not repeat across restarts, so they carry a per-process prefix
+        self._prefix = os.urandom(4).hex()
+
+    def update(self, device, timestamp, data):
+        with self._lock:
+            current = self._entries.get(device)
+            # Batches can deliver readings older than the one we already hold;
+            # the same reading again keeps its ETag
+            if current is not None and (current[0] > timestamp or (current[0] == timestamp and current[2] == data)):
+                return
+            self._version += 1
+            self._entries[device] = (timestamp, f'{self._prefix}-{self._version:x}', data)
+            if self._newest is None or self._entries[self._newest][0] <= timestamp:
+                self._newest = device
+
+    # Returns (etag, data) for the device, or for the newest device if None; None on a miss
+    def get(self, device=None):
+        with self._lock:
+            entry = self._entries.get(self._newest if device is None else device)
+        if entry is None:
+            return None
+        return entry[1], entry[2]
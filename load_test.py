@@ -0,0 +1,93 @@
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Load test for the ingestion endpoints: N simulated boards POST readings
+# concurrently and we report requests/sec and latency percentiles.
+#   python load_test.py --url http://127.0.0.1:8080/sensor-data --boards 200 --duration 30
+
+
+def make_reading(device):
+    return {
+        'device': device,
+        'temperature': round(random.uniform(18, 32), 2),
+        'humidity': round(random.uniform(35, 60), 2),
+        'pressure': round(random.uniform(99, 102), 2),
+        'light': round(random.uniform(0, 500), 2),
+        'CH2O': round(random.uniform(0.01, 0.12), 3),
+        'gas': round(random.uniform(10, 40), 2)
+    }
+
+
+def board(number, url, deadline, interval, latencies, statuses, lock):
+    target = urlsplit(url)
+    # Fake but well-formed MAC address per simulated board
+    device = 'AA:BB:CC:%02X:%02X:%02X' % ((number >> 16) & 0xFF, (number >> 8) & 0xFF, number & 0xFF)
+    while time.monotonic() < deadline:
+        body = json.dumps(make_reading(device))
+        started = time.perf_counter()
+        try:
+            # A fresh connection per reading, the same as the ESP32 firmware does
+            conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=10)
+            conn.request('POST', target.path or '/', body, {'Content-Type': 'application/json'})
+            status = conn.getresponse().status
+            conn.close()
+        except OSError:
+            status = 'error'
+        elapsed = time.perf_counter() - started
+
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+        if interval:
+            time.sleep(max(0.0, interval - elapsed))
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate concurrent SensorDuino boards')
+    parser.add_argument('--url', default='http://127.0.0.1:8080/sensor-data')
+    parser.add_argument('--boards', type=int, default=50, help='Number of concurrent boards')
+    parser.add_argument('--duration', type=float, default=10.0, help='Test length in seconds')
+    parser.add_argument('--interval', type=float, default=0.0,
+                        help='Seconds between readings per board (0 = as fast as possible)')
+    args = parser.parse_args()
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    threads = [
+        threading.Thread(target=board, args=(number, args.url, deadline, args.interval, latencies, statuses, lock))
+        for number in range(args.boards)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"Boards:        {args.boards}")
+    print(f"Requests:      {len(latencies)} in {wall:.1f} s")
+    print(f"Requests/sec:  {len(latencies) / wall:.1f}")
+    print(f"Latency p50:   {percentile(latencies, 50) * 1000:.1f} ms")
+    print(f"Latency p99:   {percentile(latencies, 99) * 1000:.1f} ms")
+    print(f"Status codes:  {statuses}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import logging
+import socketserver
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Stand-in for Redis as the SocketIO message queue, for development and tests
+# on machines without a Redis server. It speaks just enough of the Redis
+# protocol (RESP2 and RESP3) for redis-py's publish / subscribe, which is all
+# Flask-SocketIO uses: HELLO, PING, SELECT, CLIENT, SUBSCRIBE, UNSUBSCRIBE, PUBLISH.
+# Nothing is stored; a message reaches the subscribers connected right now.
+#   python message_broker.py --port 6379          (or python cli.py broker)
+#   SOCKETIO_MESSAGE_QUEUE=redis://127.0.0.1:6379/0 python cli.py web --port 5001
+
+MAX_BULK = 64 * 1024 * 1024
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+# RESP encoding of None, int, str / bytes and lists; push=True marks a RESP3 push frame
+def encode(value, push=False):
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    return (b'>' if push else b'*') + b'%d\r\n' % len(value) + b''.join(encode(item) for item in value)
+
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.channels = set()
+        self.protocol = 2  # Until the client asks for RESP3 with HELLO 3
+        self.write_lock = threading.Lock()
+
+    def send(self, data):
+        with self.write_lock:
+            self.wfile.write(data)
+
+    # Subscribe confirmations and messages: plain arrays in RESP2, push frames in RESP3
+    def send_push(self, items):
+        self.send(encode(items, push=self.protocol == 3))
+
+    def read_line(self):
+        line = self.rfile.readline(MAX_BULK)
+        if not line:
+            raise EOFError
+        return line.rstrip(b'\r\n')
+
+    # One command as a list of bytes: a RESP array of bulk strings, or an inline command
+    def read_command(self):
+        line = self.read_line()
+        if not line.startswith(b'*'):
+            return line.split()
+        command = []
+        for _ in range(int(line[1:])):
+            header = self.read_line()
+            if not header.startswith(b'$') or not 0 <= int(header[1:]) <= MAX_BULK:
+                raise ProtocolError("expected a bulk string")
+            value = self.rfile.read(int(header[1:]) + 2)
+            if len(value) != int(header[1:]) + 2:
+                raise EOFError
+            command.append(value[:-2])
+        return command
+
+    def handle(self):
+        try:
+            while True:
+                command = self.read_command()
+                if command:
+                    self.dispatch(command[0].upper().decode(errors='replace'), command[1:])
+        except (EOFError, ConnectionError):
+            pass
+        except (ProtocolError, ValueError) as e:
+            self.send(b'-ERR Protocol error: %s\r\n' % str(e).encode())
+        finally:
+            self.server.unsubscribe(self, self.channels)
+
+    def dispatch(self, name, args):
+        if name == 'HELLO':
+            version = int(args[0]) if args else self.protocol
+            if version not in (2, 3):
+                self.send(b'-NOPROTO unsupported protocol version\r\n')
+                return
+            self.protocol = version
+            info = [b'server', b'redis', b'version', b'7.0.0', b'proto', version, b'mode', b'standalone',
+                    b'role', b'master', b'modules', []]
+            if version == 3:
+                self.send(b'%%%d\r\n' % (len(info) // 2) + b''.join(encode(item) for item in info))
+            else:
+                self.send(encode(info))
+        elif name == 'PING':
+            if self.channels and self.protocol == 2:
+                self.send(encode([b'pong', args[0] if args else b'']))
+            else:
+                self.send(encode(args[0]) if args else b'+PONG\r\n')
+        elif name in ('SELECT', 'CLIENT'):
+            # One keyspace only and no client bookkeeping; accepted so redis-py can connect
+            self.send(b'+OK\r\n')
+        elif name == 'SUBSCRIBE' and args:
+            for channel in args:
+                self.channels.add(channel)
+                self.server.subscribe(self, channel)
+                self.send_push([b'subscribe', channel, len(self.channels)])
+        elif name == 'UNSUBSCRIBE':
+            for channel in args or sorted(self.channels) or [None]:
+                self.channels.discard(channel)
+                self.server.unsubscribe(self, [channel])
+                self.send_push([b'unsubscribe', channel, len(self.channels)])
+        elif name == 'PUBLISH' and len(args) == 2:
+            self.send(encode(self.server.publish(args[0], args[1])))
+        elif name == 'QUIT':
+            self.send(b'+OK\r\n')
+            raise EOFError
+        else:
+            self.send(b"-ERR unknown command '%s'\r\n" % name.encode())
+
+
+class MessageBroker(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # channel -> handlers
+        super().__init__(server_address, BrokerHandler)
+
+    def subscribe(self, handler, channel):
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(handler)
+
+    def unsubscribe(self, handler, channels):
+        with self._lock:
+            for channel in channels:
+                self._subscribers.get(channel, set()).discard(handler)
+
+    # Returns the number of subscribers the message was delivered to
+    def publish(self, channel, message):
+        with self._lock:
+            handlers = list(self._subscribers.get(channel, ()))
+        delivered = 0
+        for handler in handlers:
+            try:
+                handler.send_push([b'message', channel, message])
+                delivered += 1
+            except OSError:
+                self.unsubscribe(handler, [channel])
+        return delivered
+
+
+def serve(host='127.0.0.1', port=6379):
+    broker = MessageBroker((host, port))
+    logger.info("Message broker running on %s:%d", host, port)
+    broker.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for Redis pub/sub as the SocketIO message queue.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    serve(args.host, args.port)
@@ -0,0 +1,203 @@
+import bisect
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# In-process metrics in the Prometheus text format, served by /metrics.
+# Every metric registers itself in REGISTRY when defined; label values are
+# passed as a tuple in the order of `labelnames`. Recording takes a lock and a
+# dict or list update, cheap enough to call for every request.
+#   PARSE_SECONDS.observe(elapsed)
+#   READINGS.inc(5, (device,))
+
+REGISTRY = []
+
+# Upper bounds of the timing histograms (seconds), from 50 µs to 2.5 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Upper bounds of the batch size histograms (readings)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(f'{name}{labels} {_format_value(value)}' for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name, _labels(self.labelnames, labels), value) for labels, value in values]
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+    # Read the value from `function()` at scrape time instead, e.g. a queue length
+    def set_function(self, function):
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            return [(self.name, '', self._function())]
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name, _labels(self.labelnames, labels), value) for labels, value in values]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), then the sum of all values
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    # Context manager observing the seconds spent inside the block
+    def time(self, labels=()):
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, list(state)) for labels, state in self._values.items())
+        result = []
+        for labels, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state):
+                cumulative += count
+                result.append((f'{self.name}_bucket',
+                               _labels(self.labelnames, labels, [('le', _format_value(float(bound)))]), cumulative))
+            result.append((f'{self.name}_sum', _labels(self.labelnames, labels), state[-1]))
+            result.append((f'{self.name}_count', _labels(self.labelnames, labels), cumulative))
+        return result
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, self.labels)
+
+
+# Text exposition of every registered metric
+def render():
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# GET /metrics on a port of its own, for processes without the Flask app (`cli.py ingest`)
+def start_http_server(port, host=''):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+# Where ingestion spends its time
+PARSE_SECONDS = Histogram('sensorduino_ingest_parse_seconds',
+                          'Decoding and validating one request body.')
+ALARM_SECONDS = Histogram('sensorduino_alarm_evaluation_seconds',
+                          'Evaluating the alarm rules for the readings of one request.')
+COMMIT_SECONDS = Histogram('sensorduino_db_commit_seconds',
+                           'Writing one batch from the ingest queue to the store.')
+EMIT_SECONDS = Histogram('sensorduino_socketio_emit_seconds',
+                         'Emitting one SocketIO frame.', labelnames=('event',))
+ANOMALY_SECONDS = Histogram('sensorduino_anomaly_detection_seconds',
+                            'Running the anomaly detector over the readings of one request.')
+
+# Flow through the ingest path
+QUEUE_DEPTH = Gauge('sensorduino_ingest_queue_depth', 'Readings waiting in the write-behind queue.')
+REQUEST_READINGS = Histogram('sensorduino_ingest_request_readings',
+                             'Readings per ingest request.', SIZE_BUCKETS)
+COMMIT_READINGS = Histogram('sensorduino_db_commit_readings',
+                            'Readings per batch written to the store.', SIZE_BUCKETS)
+READINGS = Counter('sensorduino_readings_total',
+                   'Readings accepted for storage, per device.', labelnames=('device',))
+ANOMALIES = Counter('sensorduino_anomalous_readings_total',
+                    'Readings with at least one anomaly flagged, per device.', labelnames=('device',))
+DROPPED = Counter('sensorduino_readings_dropped_total',
+                  'Readings not stored: invalid, queue_full or write_failed.', labelnames=('reason',))
@@ -0,0 +1,44 @@
+"""create sensor_data table
+
+Revision ID: 4f2a9c1d7e10
+Revises: 
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f2a9c1d7e10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created by db.create_all() before migrations existed already have the table
+    if sa.inspect(op.get_bind()).has_table('sensor_data'):
+        return
+
+    op.create_table('sensor_data',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('temperature', sa.Float(), nullable=False),
+    sa.Column('humidity', sa.Float(), nullable=False),
+    sa.Column('pressure', sa.Float(), nullable=False),
+    sa.Column('light', sa.Float(), nullable=False),
+    sa.Column('tvoc', sa.Float(), nullable=False),
+    sa.Column('smoke', sa.Float(), nullable=False),
+    sa.Column('temp_alarm', sa.Integer(), nullable=False),
+    sa.Column('humidity_alarm', sa.Integer(), nullable=False),
+    sa.Column('pressure_alarm', sa.Integer(), nullable=False),
+    sa.Column('light_alarm', sa.Integer(), nullable=False),
+    sa.Column('tvoc_alarm', sa.Integer(), nullable=False),
+    sa.Column('smoke_alarm', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('sensor_data')
@@ -0,0 +1,38 @@
+"""add device_id and (device_id, timestamp) index to sensor_data
+
+Revision ID: 8b3e5d2f6a41
+Revises: 4f2a9c1d7e10
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b3e5d2f6a41'
+down_revision = '4f2a9c1d7e10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    columns = {column['name'] for column in inspector.get_columns('sensor_data')}
+    indexes = {index['name'] for index in inspector.get_indexes('sensor_data')}
+
+    # Existing readings came from the single board in use before devices were tracked
+    if 'device_id' not in columns:
+        with op.batch_alter_table('sensor_data', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('device_id', sa.String(length=32), nullable=False,
+                                          server_default='unknown'))
+
+    if 'ix_sensor_data_device_id_timestamp' not in indexes:
+        with op.batch_alter_table('sensor_data', schema=None) as batch_op:
+            batch_op.create_index('ix_sensor_data_device_id_timestamp', ['device_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('sensor_data', schema=None) as batch_op:
+        batch_op.drop_index('ix_sensor_data_device_id_timestamp')
+        batch_op.drop_column('device_id')
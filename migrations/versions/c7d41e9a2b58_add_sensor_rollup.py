@@ -0,0 +1,41 @@
+"""add sensor_rollup table for 1-minute and 1-hour aggregates
+
+Revision ID: c7d41e9a2b58
+Revises: 8b3e5d2f6a41
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d41e9a2b58'
+down_revision = '8b3e5d2f6a41'
+branch_labels = None
+depends_on = None
+
+SENSORS = ('temperature', 'humidity', 'pressure', 'light', 'tvoc', 'smoke')
+ALARMS = ('temp_alarm', 'humidity_alarm', 'pressure_alarm', 'light_alarm', 'tvoc_alarm', 'smoke_alarm')
+
+
+def upgrade():
+    # db.create_all() may already have created it on a fresh database
+    if sa.inspect(op.get_bind()).has_table('sensor_rollup'):
+        return
+
+    op.create_table('sensor_rollup',
+    sa.Column('resolution', sa.Integer(), nullable=False),
+    sa.Column('device_id', sa.String(length=32), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    *[sa.Column(f'{name}_{stat}', sa.Float(), nullable=False) for name in SENSORS for stat in ('min', 'max', 'sum')],
+    sa.Column('alarm_count', sa.Integer(), nullable=False),
+    *[sa.Column(f'{alarm}_count', sa.Integer(), nullable=False) for alarm in ALARMS],
+    sa.PrimaryKeyConstraint('resolution', 'device_id', 'bucket_start')
+    )
+    # Existing readings are folded in with `flask backfill-rollups`
+
+
+def downgrade():
+    op.drop_table('sensor_rollup')
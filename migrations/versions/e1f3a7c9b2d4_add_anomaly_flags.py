@@ -0,0 +1,31 @@
+"""add anomaly_flags to sensor_data
+
+Revision ID: e1f3a7c9b2d4
+Revises: c7d41e9a2b58
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1f3a7c9b2d4'
+down_revision = 'c7d41e9a2b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    columns = {column['name'] for column in inspector.get_columns('sensor_data')}
+
+    # Readings stored before the detector ran have no anomalies flagged
+    if 'anomaly_flags' not in columns:
+        with op.batch_alter_table('sensor_data', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('anomaly_flags', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('sensor_data', schema=None) as batch_op:
+        batch_op.drop_column('anomaly_flags')
@@ -0,0 +1,87 @@
+from datetime import datetime
+
+from flask_sqlalchemy import SQLAlchemy
+
+from ingest import UNKNOWN_DEVICE
+
+db = SQLAlchemy()
+
+# SQLite database, relative to the Flask instance folder
+DATABASE_URI = 'sqlite:///sensor_data.db'
+
+
+# Define SensorData model with detailed alarm flags
+class SensorData(db.Model):
+    __tablename__ = 'sensor_data'
+    __table_args__ = (
+        # Per-device range and latest-value queries walk this index instead of the whole table
+        db.Index('ix_sensor_data_device_id_timestamp', 'device_id', 'timestamp'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    # Board that sent the reading (its WiFi MAC address)
+    device_id = db.Column(db.String(32), nullable=False, default=UNKNOWN_DEVICE, server_default=UNKNOWN_DEVICE)
+
+    temperature = db.Column(db.Float, nullable=False)
+    humidity = db.Column(db.Float, nullable=False)
+    pressure = db.Column(db.Float, nullable=False)
+    light = db.Column(db.Float, nullable=False)
+    tvoc = db.Column(db.Float, nullable=False)
+    smoke = db.Column(db.Float, nullable=False)
+
+    # Individual alarm flags for each sensor
+    temp_alarm = db.Column(db.Integer, nullable=False, default=0)
+    humidity_alarm = db.Column(db.Integer, nullable=False, default=0)
+    pressure_alarm = db.Column(db.Integer, nullable=False, default=0)
+    light_alarm = db.Column(db.Integer, nullable=False, default=0)
+    tvoc_alarm = db.Column(db.Integer, nullable=False, default=0)
+    smoke_alarm = db.Column(db.Integer, nullable=False, default=0)
+
+    # Streaming anomaly detector findings, four bits per sensor (see anomaly.py)
+    anomaly_flags = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # Timestamp to indicate the live time for the data
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+# Per-device aggregates of SensorData over fixed time buckets (1 minute and 1 hour),
+# kept up to date by the ingestion writer in the same transaction as the raw rows.
+# Means are sum / count so partial buckets can be merged incrementally.
+class SensorRollup(db.Model):
+    __tablename__ = 'sensor_rollup'
+
+    # Bucket width in seconds, see rollups.RESOLUTIONS
+    resolution = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(32), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+
+    count = db.Column(db.Integer, nullable=False)
+
+    temperature_min = db.Column(db.Float, nullable=False)
+    temperature_max = db.Column(db.Float, nullable=False)
+    temperature_sum = db.Column(db.Float, nullable=False)
+    humidity_min = db.Column(db.Float, nullable=False)
+    humidity_max = db.Column(db.Float, nullable=False)
+    humidity_sum = db.Column(db.Float, nullable=False)
+    pressure_min = db.Column(db.Float, nullable=False)
+    pressure_max = db.Column(db.Float, nullable=False)
+    pressure_sum = db.Column(db.Float, nullable=False)
+    light_min = db.Column(db.Float, nullable=False)
+    light_max = db.Column(db.Float, nullable=False)
+    light_sum = db.Column(db.Float, nullable=False)
+    tvoc_min = db.Column(db.Float, nullable=False)
+    tvoc_max = db.Column(db.Float, nullable=False)
+    tvoc_sum = db.Column(db.Float, nullable=False)
+    smoke_min = db.Column(db.Float, nullable=False)
+    smoke_max = db.Column(db.Float, nullable=False)
+    smoke_sum = db.Column(db.Float, nullable=False)
+
+    # Number of readings in the bucket with any alarm raised, and per alarm flag
+    alarm_count = db.Column(db.Integer, nullable=False, default=0)
+    temp_alarm_count = db.Column(db.Integer, nullable=False, default=0)
+    humidity_alarm_count = db.Column(db.Integer, nullable=False, default=0)
+    pressure_alarm_count = db.Column(db.Integer, nullable=False, default=0)
+    light_alarm_count = db.Column(db.Integer, nullable=False, default=0)
+    tvoc_alarm_count = db.Column(db.Integer, nullable=False, default=0)
+    smoke_alarm_count = db.Column(db.Integer, nullable=False, default=0)
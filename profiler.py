@@ -0,0 +1,68 @@
+import os
+import signal
+import time
+
+# Statistical CPU profiler that can be switched on while the server runs.
+# A SIGPROF interval timer interrupts the process every `interval` seconds of
+# CPU time and the handler counts the interrupted call stack. Under eventlet
+# every green thread runs on the main OS thread, which is where signals are
+# delivered, so the samples cover request handlers and background work alike.
+# Idle time (waiting on sockets) is not sampled. The result is in the folded
+# format flame graph tools read: "file:function;file:function <samples>".
+# Off by default; nothing runs on the hot path until start() is called.
+
+MAX_DEPTH = 64
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self.interval = None
+        self.started_at = None
+        self.samples = 0
+        self._stacks = {}
+        # The handler can only be installed from the main thread, the timer may be armed from any
+        self.available = hasattr(signal, 'setitimer')
+        if self.available:
+            try:
+                signal.signal(signal.SIGPROF, self._sample)
+            except ValueError:
+                self.available = False
+
+    @property
+    def running(self):
+        return self.interval is not None
+
+    def start(self, interval=0.005):
+        if not self.available:
+            raise RuntimeError("Sampling needs SIGPROF and must be set up from the main thread")
+        self._stacks = {}
+        self.samples = 0
+        self.started_at = time.time()
+        self.interval = interval
+        signal.setitimer(signal.ITIMER_PROF, interval, interval)
+
+    def stop(self):
+        if self.available:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        self.interval = None
+        return self.folded()
+
+    # Signal handler: runs between two bytecodes of the interrupted code, so no locks here
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None and len(stack) < MAX_DEPTH:
+            code = frame.f_code
+            stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+            frame = frame.f_back
+        key = ';'.join(reversed(stack))
+        self._stacks[key] = self._stacks.get(key, 0) + 1
+        self.samples += 1
+
+    # Folded stacks, most sampled first
+    def folded(self):
+        stacks = sorted(self._stacks.items(), key=lambda item: item[1], reverse=True)
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks)
+
+    def status(self):
+        return {'available': self.available, 'running': self.running, 'interval': self.interval,
+                'started_at': self.started_at, 'samples': self.samples}
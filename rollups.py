@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from history import SENSOR_COLUMNS, db_time
+
+ALARM_COLUMNS = ('temp_alarm', 'humidity_alarm', 'pressure_alarm', 'light_alarm', 'tvoc_alarm', 'smoke_alarm')
+
+# Rollup resolutions by name, bucket width in seconds
+RESOLUTIONS = {'1m': 60, '1h': 3600}
+
+EPOCH = datetime(1970, 1, 1)
+
+STAT_COLUMNS = (
+    ['count', 'alarm_count']
+    + [f'{alarm}_count' for alarm in ALARM_COLUMNS]
+    + [f'{name}_{stat}' for name in SENSOR_COLUMNS for stat in ('min', 'max', 'sum')]
+)
+
+
+def _merge_expression(column):
+    if column.endswith('_min'):
+        return f'{column} = min({column}, excluded.{column})'
+    if column.endswith('_max'):
+        return f'{column} = max({column}, excluded.{column})'
+    return f'{column} = {column} + excluded.{column}'
+
+
+# Add partial buckets to the stored ones, creating buckets that do not exist yet
+UPSERT_SQL = text(
+    'INSERT INTO sensor_rollup (resolution, device_id, bucket_start, ' + ', '.join(STAT_COLUMNS) + ') '
+    'VALUES (:resolution, :device_id, :bucket_start, ' + ', '.join(f':{c}' for c in STAT_COLUMNS) + ') '
+    'ON CONFLICT (resolution, device_id, bucket_start) DO UPDATE SET '
+    + ', '.join(_merge_expression(c) for c in STAT_COLUMNS)
+)
+
+
+def bucket_start(timestamp, resolution):
+    seconds = (timestamp - EPOCH).total_seconds()
+    return EPOCH + timedelta(seconds=int(seconds // resolution * resolution))
+
+
+# Fold a batch of SensorData rows into partial buckets for every resolution
+def aggregate(rows):
+    buckets = {}
+    for row in rows:
+        alarms = [row[alarm] for alarm in ALARM_COLUMNS]
+        for resolution in RESOLUTIONS.values():
+            key = (resolution, row['device_id'], bucket_start(row['timestamp'], resolution))
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = {
+                    'resolution': resolution,
+                    'device_id': row['device_id'],
+                    'bucket_start': db_time(key[2]),
+                    'count': 0,
+                    'alarm_count': 0
+                }
+                for alarm in ALARM_COLUMNS:
+                    bucket[f'{alarm}_count'] = 0
+                for name in SENSOR_COLUMNS:
+                    bucket[f'{name}_min'] = row[name]
+                    bucket[f'{name}_max'] = row[name]
+                    bucket[f'{name}_sum'] = 0.0
+
+            bucket['count'] += 1
+            if any(alarms):
+                bucket['alarm_count'] += 1
+            for alarm, flag in zip(ALARM_COLUMNS, alarms):
+                if flag:
+                    bucket[f'{alarm}_count'] += 1
+            for name in SENSOR_COLUMNS:
+                value = row[name]
+                if value < bucket[f'{name}_min']:
+                    bucket[f'{name}_min'] = value
+                if value > bucket[f'{name}_max']:
+                    bucket[f'{name}_max'] = value
+                bucket[f'{name}_sum'] += value
+    return list(buckets.values())
+
+
+# Merge a batch of new rows into the rollups, inside the caller's transaction
+def apply(connection, rows):
+    buckets = aggregate(rows)
+    if buckets:
+        connection.execute(UPSERT_SQL, buckets)
+
+
+def list_devices(engine):
+    with engine.connect() as connection:
+        return [row[0] for row in connection.execute(text('SELECT DISTINCT device_id FROM sensor_data'))]
+
+
+def _backfill_sql(resolution):
+    # Same bucket boundaries and timestamp format as bucket_start() / db_time()
+    bucket = f"datetime(CAST(strftime('%s', timestamp) AS INTEGER) / {resolution} * {resolution}, 'unixepoch') || '.000000'"
+    any_alarm = ' OR '.join(ALARM_COLUMNS)
+    selects = ['COUNT(*)', f'SUM({any_alarm})'] + [f'SUM({alarm})' for alarm in ALARM_COLUMNS]
+    for name in SENSOR_COLUMNS:
+        selects += [f'MIN({name})', f'MAX({name})', f'SUM({name})']
+    return text(
+        'INSERT INTO sensor_rollup (resolution, device_id, bucket_start, ' + ', '.join(STAT_COLUMNS) + ') '
+        f'SELECT {resolution}, device_id, {bucket} AS bucket, ' + ', '.join(selects) + ' '
+        'FROM sensor_data WHERE device_id = :device_id AND timestamp >= :since GROUP BY bucket'
+    )
+
+
+# Rebuild the rollups from the raw table (of all devices unless given), one device
+# per transaction so the ingestion writer is only held up for as long as one device takes.
+# Buckets before a device's oldest raw reading are left alone: their readings have
+# been archived, and archiving cuts at midnight so no bucket is split between the two.
+def backfill(engine, devices=None):
+    if devices is None:
+        devices = list_devices(engine)
+
+    for device_id in devices:
+        with engine.begin() as connection:
+            oldest = connection.execute(text('SELECT MIN(timestamp) FROM sensor_data WHERE device_id = :device_id'),
+                                        {'device_id': device_id}).scalar()
+            if oldest is None:
+                continue
+            oldest = datetime.fromisoformat(oldest) if isinstance(oldest, str) else oldest
+            for resolution in RESOLUTIONS.values():
+                since = db_time(bucket_start(oldest, resolution))
+                connection.execute(text('DELETE FROM sensor_rollup WHERE resolution = :resolution'
+                                        ' AND device_id = :device_id AND bucket_start >= :since'),
+                                   {'resolution': resolution, 'device_id': device_id, 'since': since})
+                connection.execute(_backfill_sql(resolution), {'device_id': device_id, 'since': since})
+    return devices
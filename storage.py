@@ -0,0 +1,101 @@
+import logging
+import threading
+
+from sqlalchemy import create_engine, event
+
+logger = logging.getLogger(__name__)
+
+# SQLite is run in WAL mode: readers work on a snapshot and never block the
+# writer, and the writer never blocks readers. All writes of the server go
+# through one dedicated writer connection, reads go through a pool of
+# read-only connections, so readers can not take the write lock by accident.
+
+# Applied to every connection
+PRAGMAS = {
+    'busy_timeout': 5000,  # Wait up to 5 s for a lock (other processes, checkpoints) instead of failing
+    'synchronous': 'NORMAL',  # WAL stays consistent on power loss, only the last commits may be lost
+    'cache_size': -32000,  # Page cache per connection in KiB (negative value)
+    'mmap_size': 268435456,  # Read the first 256 MiB of the file through the OS page cache
+    'temp_store': 'MEMORY'
+}
+
+# Pages in the WAL before a commit checkpoints by itself. Kept well above the
+# default (1000) so the checkpointer thread does that work instead of the ingest writer.
+WAL_AUTOCHECKPOINT = 10000
+
+
+def _set_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+    finally:
+        cursor.close()
+
+
+# Apply the pragmas to every new connection of a SQLite engine. Writable
+# engines also switch the database to WAL (a no-op once it is).
+def configure(engine, read_only=False):
+    if engine.dialect.name != 'sqlite':
+        return engine
+
+    pragmas = dict(PRAGMAS)
+    if read_only:
+        pragmas['query_only'] = 'ON'
+    else:
+        pragmas['journal_mode'] = 'WAL'
+        pragmas['wal_autocheckpoint'] = WAL_AUTOCHECKPOINT
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        _set_pragmas(dbapi_connection, pragmas)
+
+    return engine
+
+
+# A single connection, so writes are serialised in the pool rather than by SQLite locks
+def create_writer_engine(url):
+    return configure(create_engine(url, pool_size=1, max_overflow=0, pool_timeout=30))
+
+
+def create_reader_engine(url, pool_size=8):
+    return configure(create_engine(url, pool_size=pool_size, max_overflow=pool_size), read_only=True)
+
+
+# Checkpoints the WAL back into the database file every `interval` seconds.
+# PASSIVE checkpoints never wait for readers, so a long dashboard query only
+# delays how far the checkpoint gets; the WAL is truncated when stopping.
+class Checkpointer:
+    def __init__(self, engine, interval=60.0):
+        self.engine = engine
+        self.interval = interval
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def checkpoint(self, mode='PASSIVE'):
+        with self.engine.connect() as connection:
+            # (busy, WAL pages, pages checkpointed)
+            return tuple(connection.exec_driver_sql(f'PRAGMA wal_checkpoint({mode})').fetchone())
+
+    def start(self):
+        if self._thread is None and self.engine.dialect.name == 'sqlite':
+            self._thread = threading.Thread(target=self._run, name='wal-checkpointer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval * 2)
+            self._thread = None
+            try:
+                self.checkpoint('TRUNCATE')
+            except Exception as e:
+                logger.error("Final WAL checkpoint failed: %s", e)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.checkpoint()
+            except Exception as e:
+                logger.error("WAL checkpoint failed: %s", e)
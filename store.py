@@ -0,0 +1,91 @@
+from sqlalchemy import select
+
+import history
+import rollups
+import storage
+from models import SensorData
+
+# Where the server keeps live readings. Every backend offers the same four
+# operations, so the ingest path and the dashboard routes do not care which
+# one is configured (app.config['STORAGE_BACKEND']):
+#   append(rows)                                  store a batch of SensorData row dicts
+#   latest(device=None, limit=1)                  newest rows, newest first, as row dicts
+#   range_columns(device, start, end)             readings in [start, end) as in history.fetch_columns
+#   rollup_columns(device, resolution, start, end) buckets as in history.fetch_rollup_columns
+# plus start() / close() for background work the backend needs.
+# Row dicts carry device_id, timestamp (naive UTC datetime), SENSOR_COLUMNS, ALARM_COLUMNS and anomaly_flags.
+
+
+class SensorStore:
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    def append(self, rows):
+        raise NotImplementedError
+
+    def latest(self, device=None, limit=1):
+        raise NotImplementedError
+
+    def range_columns(self, device, start, end):
+        raise NotImplementedError
+
+    def rollup_columns(self, device, resolution, start, end):
+        raise NotImplementedError
+
+
+# The SensorData / sensor_rollup tables, written through one connection and
+# read through the read-only pool (see storage.py)
+class SQLiteStore(SensorStore):
+    def __init__(self, url, read_pool_size=8, checkpoint_interval=60.0):
+        self.writer = storage.create_writer_engine(url)
+        self.reader = storage.create_reader_engine(url, read_pool_size)
+        self.checkpointer = storage.Checkpointer(self.writer, checkpoint_interval)
+
+    def start(self):
+        self.checkpointer.start()
+
+    def close(self):
+        self.checkpointer.stop()
+
+    # Insert with a single executemany and fold the rows into the rollups, in one commit
+    def append(self, rows):
+        with self.writer.begin() as connection:
+            connection.execute(SensorData.__table__.insert(), rows)
+            rollups.apply(connection, rows)
+
+    def latest(self, device=None, limit=1):
+        query = select(SensorData.__table__).limit(limit)
+        if device:
+            query = query.where(SensorData.device_id == device).order_by(SensorData.timestamp.desc())
+        else:
+            query = query.order_by(SensorData.id.desc())
+        with self.reader.connect() as connection:
+            return [dict(row) for row in connection.execute(query).mappings()]
+
+    def range_columns(self, device, start, end):
+        connection = self.reader.raw_connection()
+        try:
+            return history.fetch_columns(connection, device, start, end)
+        finally:
+            connection.close()
+
+    def rollup_columns(self, device, resolution, start, end):
+        connection = self.reader.raw_connection()
+        try:
+            return history.fetch_rollup_columns(connection, device, resolution, start, end)
+        finally:
+            connection.close()
+
+
+# The backend named by app.config['STORAGE_BACKEND']; options of the other backend are ignored
+def open_store(backend, database_url=None, directory=None, read_pool_size=8, checkpoint_interval=60.0):
+    if backend == 'sqlite':
+        return SQLiteStore(database_url, read_pool_size, checkpoint_interval)
+    if backend == 'columns':
+        from column_store import ColumnFileStore
+
+        return ColumnFileStore(directory)
+    raise ValueError(f"Unknown storage backend {backend!r}, expected 'sqlite' or 'columns'")